@@ -33,11 +33,55 @@ __author__ = 'api.jscudder (Jeffrey Scudder)'
        used to specify information about the request.
 """
 import os
+import sys
 import httplib
 import urllib
 import re
 import base64
+import errno
+import select
 import socket
+import stat
+import time
+import urlparse
+from raws_json.connection_pool import ConnectionPool, PooledResponse
+from raws_json.content_encoding import DecodeResponse
+from raws_json.redirects import (RedirectCache, NormalizeUri,
+    KeepsCredentials, REDIRECT_STATUSES, PERMANENT_REDIRECT_STATUSES,
+    SAFE_METHODS, CREDENTIAL_HEADERS)
+from raws_json.retry import RetryPolicy, IDEMPOTENT_METHODS
+from raws_json.circuit_breaker import CircuitBreaker, CircuitOpenError
+from raws_json.rate_limit import RateLimiter, GetAccountRateLimiter, RateLimitTimeout
+from raws_json.deadline import (Timeout, Deadline, DeadlineExceeded,
+    Current as CurrentDeadline, Earliest as EarliestDeadline)
+from raws_json.dns_cache import DnsCache, CreateConnection
+from raws_json.request_hooks import (RequestHooks, RequestEvent, TimedResponse,
+    UriTemplate, DNS, CONNECT, TLS, REQUEST_SENT, FIRST_BYTE, REQUEST_ERROR)
+from raws_json.tracing import Tracer, TracedResponse
+from raws_json.tls import CreateContext as CreateSslContext, GetDefaultContext
+from raws_json.metrics import MetricsRegistry
+
+# Connection pool shared by all RawsService objects which don't specify their
+# own. Set the connection_pool member of a service to None to disable pooling.
+default_connection_pool = ConnectionPool()
+
+# Request metrics shared by the RawsService objects which are created with
+# metrics=default_metrics, see raws_json.metrics. Services keep no metrics
+# unless they are given a MetricsRegistry.
+default_metrics = MetricsRegistry()
+default_metrics.add_pool(default_connection_pool, 'default')
+
+# Permanent redirects remembered for all RawsService objects.
+default_redirect_cache = RedirectCache()
+
+# Resolved host names shared by all RawsService objects.
+default_dns_cache = DnsCache()
+
+# Number of bytes read from a file-like object per send() when uploading.
+UPLOAD_BUFFER_SIZE = 256 * 1024
+
+# Number of bytes read from a response per write() when downloading to a file.
+DOWNLOAD_BUFFER_SIZE = 256 * 1024
 
 URL_REGEX = re.compile('http(s)?\://([\w\.-]*)(\:(\d+))?(/.*)?')
 
@@ -54,6 +98,40 @@ class JsonService(object):
   # If debug is True, the HTTPConnection will display debug information
   debug = False
 
+  # If set, connections are taken from (and returned to) this ConnectionPool
+  connection_pool = None
+
+  # Compressed encodings accepted for response bodies (None to disable)
+  accept_encoding = 'gzip, deflate'
+
+  # If set, permanent redirects are remembered in this RedirectCache
+  redirect_cache = None
+
+  # If set, failed requests are retried according to this RetryPolicy
+  retry_policy = None
+
+  # If set, requests to failing servers are stopped by this CircuitBreaker
+  circuit_breaker = None
+
+  # If set, requests wait for this RateLimiter before they are sent
+  rate_limiter = None
+
+  # Connect, read and total timeouts of requests (a Timeout, or None)
+  timeout = None
+
+  # If set, new connections resolve host names through this DnsCache
+  dns_cache = None
+
+  # SSLContext of the HTTPS connections, see raws_json.tls (None for the
+  # context shared by all services)
+  ssl_context = None
+
+  # If set, the phases of every request are reported to these RequestHooks
+  request_hooks = None
+
+  # If set, every request is recorded as a span by this Tracer
+  tracer = None
+
   def __init__(self, server=None, additional_headers=None):
     """Creates a new JsonService client.
     
@@ -235,7 +313,8 @@ class JsonService(object):
     return HttpRequest(self, 'DELETE', None, uri, extra_headers=extra_headers, 
         url_params=url_params, escape_params=escape_params)
 
-  def Head(self, uri, extra_headers=None, url_params=None, escape_params=True):
+  def Head(self, uri, extra_headers=None, url_params=None, escape_params=True,
+           redirects_remaining=4, timeout=None):
     """Send a HEAD request to the APP server with the given URI
 
     The uri is the portion of the URI after the server value 
@@ -264,16 +343,22 @@ class JsonService(object):
                    reserved characters have been escaped). If true, this
                    method will escape the query and any URL parameters
                    provided.
+    redirects_remaining: int (optional) Maximum number of redirects which
+                   are followed.
+    timeout: Timeout or float (optional) Overrides the timeouts of the
+                   service for this request.
 
     Returns:
     httplib.HTTPResponse The server's response to the GET request.
     """
     return HttpRequest(self, 'HEAD', None, uri, extra_headers=extra_headers, 
-          url_params=url_params, escape_params=escape_params)
+          url_params=url_params, escape_params=escape_params,
+          redirects_remaining=redirects_remaining, timeout=timeout)
 
 
 def HttpRequest(service, operation, data, uri, extra_headers=None, 
-      url_params=None, escape_params=True, content_type='application/atom+xml'):
+      url_params=None, escape_params=True, content_type='application/atom+xml',
+      redirects_remaining=0, idempotent=None, timeout=None):
     """Performs an HTTP call to the server, supports GET, POST, PUT, and DELETE.
 
     Usage example, perform and HTTP GET on http://www.google.com/:
@@ -299,6 +384,11 @@ def HttpRequest(service, operation, data, uri, extra_headers=None,
           a chunk of 100K bytes at a time and send them. 
           If the data is a list of parts to be sent, each part will be evaluated
           and sent.
+          If the data is a generator or another iterable, the strings it 
+          produces are sent as they come.
+          When the length of the data can't be determined (and no 
+          Content-Length header is given), the data is sent with chunked 
+          transfer-encoding.
       uri: The beginning of the URL to which the request should be sent. 
           Examples: '/', '/base/feeds/snippets', 
           '/m8/feeds/contacts/default/base'
@@ -313,78 +403,538 @@ def HttpRequest(service, operation, data, uri, extra_headers=None,
           (Special characters converted to %XX form.)
       content_type: str The MIME type for the data being sent. Defaults to
           'application/atom+xml', this is only used if data is set.
+      redirects_remaining: int default 0. Maximum number of redirects (301,
+          302, 303, 307 and 308 responses) which are followed. A 303, or a
+          301/302 in response to a POST, is followed with a GET without data.
+          Otherwise the request is repeated, unless its data can't be sent a 
+          second time; the redirect response is then returned.
+          Permanent redirects are remembered in service.redirect_cache (if
+          set), later requests go to the new location right away.
+          The Authorization and Cookie headers are not sent along to another
+          host, nor from https to http.
+      idempotent: bool (optional) Whether the request may be retried
+          according to service.retry_policy (if set). By default GET, HEAD,
+          PUT and DELETE requests are retried, POST requests are not.
+          The number of retries is set as the retries attribute of the
+          returned response.
+      timeout: Timeout or float (optional) Overrides the values of 
+          service.timeout (if set) for this request, a number is used as 
+          connect and read timeout. The total timeout (and the Deadline of the
+          current thread, if any) bounds the request including its retries and
+          redirects; DeadlineExceeded is raised once it has passed.
+
+    If service.request_hooks is set, every attempt of the request is reported 
+    to its hooks, see raws_json.request_hooks.
+
+    If service.tracer is set, the request (including its retries and 
+    redirects) is recorded as a span, which ends when the response has been
+    read. Its id is sent in a traceparent header, see raws_json.tracing.
     """
+    tracer = getattr(service, 'tracer', None)
+    if tracer is None:
+      return __HttpRequest(service, operation, data, uri, extra_headers, 
+          url_params, escape_params, content_type, redirects_remaining, 
+          idempotent, timeout)
+    absolute_uri = __AbsoluteUri(service, 
+        BuildUri(uri, url_params, escape_params))
+    hooks = getattr(service, 'request_hooks', None)
+    if hooks is not None:
+      uri_template = hooks.uri_template(absolute_uri)
+    else:
+      uri_template = UriTemplate(absolute_uri)
+    span = tracer.start_span('%s %s' % (operation, uri_template), {
+        'service.name': service.__class__.__name__,
+        'http.method': operation,
+        'http.url': absolute_uri,
+        'http.route': uri_template})
+    extra_headers = dict(extra_headers or {})
+    extra_headers['traceparent'] = span.traceparent()
+    try:
+      response = __HttpRequest(service, operation, data, uri, extra_headers, 
+          url_params, escape_params, content_type, redirects_remaining, 
+          idempotent, timeout)
+    except:
+      span.end(sys.exc_info()[1])
+      raise
+    span.set_attribute('http.status_code', response.status)
+    span.set_attribute('http.request_content_length', 
+        getattr(response, 'bytes_sent', 0))
+    span.set_attribute('raws.retries', getattr(response, 'retries', 0))
+    return TracedResponse(response, span)
+
+
+def __HttpRequest(service, operation, data, uri, extra_headers=None, 
+      url_params=None, escape_params=True, content_type='application/atom+xml',
+      redirects_remaining=0, idempotent=None, timeout=None, credentials=True):
+    # credentials is False once the request has been redirected to another 
+    # host, see KeepsCredentials.
     full_uri = BuildUri(uri, url_params, escape_params)
-    (connection, full_uri) = PrepareConnection(service, full_uri)
-
-    if extra_headers is None:
-      extra_headers = {}
-
-    # Turn on debug mode if the debug member is set.
-    if service.debug:
-      connection.debuglevel = 1
-
-    connection.putrequest(operation, full_uri)
-
-    # If the list of headers does not include a Content-Length, attempt to 
-    # calculate it based on the data object.
+    absolute_uri = __AbsoluteUri(service, full_uri)
+    redirect_cache = getattr(service, 'redirect_cache', None)
+    if redirect_cache is not None:
+      moved_uri = redirect_cache.resolve(absolute_uri, operation)
+      if moved_uri is not None:
+        if not KeepsCredentials(absolute_uri, moved_uri):
+          credentials = False
+        full_uri = absolute_uri = moved_uri
+    (pool_key, full_uri, factory) = __ConnectionParams(service, full_uri)
+    pool = getattr(service, 'connection_pool', None)
+
+    timeout = (getattr(service, 'timeout', None) or Timeout()).merge(timeout)
+    deadline = CurrentDeadline()
+    if timeout.total is not None:
+      deadline = EarliestDeadline(deadline, Deadline(timeout.total))
+
+    # The headers are added to a copy, the caller's dict is left alone.
+    extra_headers = dict(extra_headers or {})
+    if not credentials:
+      extra_headers = __WithoutCredentials(extra_headers)
+
+    # If the list of headers does not include a Content-Length (or a 
+    # Transfer-Encoding, which excludes it), attempt to calculate it based on 
+    # the data object.
     if (data and not service.additional_headers.has_key('Content-Length') and 
-        not extra_headers.has_key('Content-Length')):
+        not extra_headers.has_key('Content-Length') and 
+        not service.additional_headers.has_key('Transfer-Encoding') and
+        not extra_headers.has_key('Transfer-Encoding')):
       content_length = __CalculateDataLength(data)
       if content_length:
         extra_headers['Content-Length'] = str(content_length)
+      elif content_length is None:
+        # The length is not known in advance (pipe, generator, ...), so the 
+        # data is streamed using the HTTP/1.1 chunked transfer-coding.
+        extra_headers['Transfer-Encoding'] = 'chunked'
       else:
         extra_headers['Content-Length'] = "0"
+    chunked = (extra_headers.get('Transfer-Encoding', 
+        service.additional_headers.get('Transfer-Encoding')) == 'chunked')
 
     if content_type:
       extra_headers['Content-Type'] = content_type 
 
+    # Ask for a compressed response body, it is decoded while it is read.
+    accept_encoding = getattr(service, 'accept_encoding', None)
+    if (accept_encoding and 
+        not service.additional_headers.has_key('Accept-Encoding') and 
+        not extra_headers.has_key('Accept-Encoding')):
+      extra_headers['Accept-Encoding'] = accept_encoding
+
+    # Failed requests are sent again according to the service's RetryPolicy,
+    # provided that the data can be sent a second time.
+    rewind = __GetRewinder(data)
+    retry_policy = getattr(service, 'retry_policy', None)
+    if retry_policy is not None and not retry_policy.allows(operation, idempotent):
+      retry_policy = None
+    breaker = getattr(service, 'circuit_breaker', None)
+    limiter = getattr(service, 'rate_limiter', None)
+    hooks = getattr(service, 'request_hooks', None) or None
+    # Whether the request may be sent again after it may have been processed.
+    replayable = idempotent
+    if replayable is None:
+      replayable = operation in IDEMPOTENT_METHODS
+    attempt = 0
+    delay = None
+    while True:
+      connect_timeout = timeout.connect
+      read_timeout = timeout.read
+      if deadline is not None:
+        deadline.check('%s %s' % (operation, absolute_uri))
+        connect_timeout = __Min(connect_timeout, deadline.remaining())
+        read_timeout = __Min(read_timeout, deadline.remaining())
+      if limiter is not None:
+        try:
+          limiter.wait(operation, absolute_uri, 
+              deadline and deadline.remaining())
+        except RateLimitTimeout:
+          raise DeadlineExceeded('Deadline exceeded waiting for the rate limit '
+              'of %s %s' % (operation, absolute_uri))
+      if breaker is not None:
+        # Fails fast (with a CircuitOpenError) while the server is failing.
+        breaker.acquire(pool_key[:2])
+      headers = extra_headers
+      event = None
+      start = time.time()
+      try:
+        if hooks is not None:
+          # The hooks get a copy of the headers, which they may change.
+          headers = dict(extra_headers)
+          event = hooks.start(service, operation, absolute_uri, headers, attempt)
+        response = __GetResponse(service, pool, pool_key, factory, operation, 
+            full_uri, headers, data, chunked, rewind, replayable, 
+            connect_timeout, read_timeout, event, credentials)
+      except (socket.error, httplib.HTTPException), e:
+        if breaker is not None:
+          breaker.record(pool_key[:2])
+        if retry_policy is None or (data and rewind is None):
+          raise
+        delay = retry_policy.delay(attempt, delay)
+        if delay is None or (deadline and delay >= deadline.remaining()):
+          raise
+        reason = e
+      except:
+        # Not a failure of the server (e.g. a PoolTimeout or an interrupt).
+        if breaker is not None:
+          breaker.cancel(pool_key[:2])
+        raise
+      else:
+        if breaker is not None:
+          breaker.record(pool_key[:2], response.status, time.time() - start)
+        if (retry_policy is None or response.status not in retry_policy.statuses
+            or (data and rewind is None)):
+          break
+        delay = retry_policy.delay(attempt, delay, response)
+        if delay is None or (deadline and delay >= deadline.remaining()):
+          break
+        reason = response.status
+        response.read()
+      attempt += 1
+      retry_policy.record(operation, absolute_uri, attempt, delay, reason)
+      time.sleep(delay)
+      if data:
+        rewind()
+    response.retries = attempt
+
+    location = response.getheader('Location')
+    if (redirects_remaining <= 0 or response.status not in REDIRECT_STATUSES 
+        or not location):
+      return response
+    # A 301 changes the method of a POST, so it is only remembered for the
+    # methods it leaves alone; a 308 never changes the request.
+    cacheable = (response.status == 308 or 
+        (response.status in PERMANENT_REDIRECT_STATUSES and 
+         operation in SAFE_METHODS))
+    if (response.status == 303 or 
+        (response.status in (301, 302) and operation == 'POST')):
+      if operation != 'HEAD':
+        operation = 'GET'
+      data = None
+    elif data and rewind is None:
+      # The data (e.g. a generator) has been consumed, it can't be sent to 
+      # the new location.
+      return response
+    # Read the (short) body, so the connection goes back to the pool.
+    response.read()
+    location = urlparse.urljoin(absolute_uri, location)
+    if redirect_cache is not None and cacheable:
+      redirect_cache.add(absolute_uri, location, response.status)
+    if not KeepsCredentials(absolute_uri, location):
+      credentials = False
+    headers = dict(extra_headers)
+    if data:
+      rewind()
+    else:
+      content_type = None
+      for header in headers.keys():
+        if header.lower() in ('content-length', 'content-type', 
+            'transfer-encoding', 'slug', 'mime-version'):
+          del headers[header]
+    if deadline is not None:
+      # The redirected request gets the time that is left.
+      timeout = Timeout(timeout.connect, timeout.read, deadline.remaining())
+    return __HttpRequest(service, operation, data, location, extra_headers=headers,
+        content_type=content_type, redirects_remaining=redirects_remaining - 1,
+        idempotent=idempotent, timeout=timeout, credentials=credentials)
+
+
+def __GetResponse(service, pool, pool_key, factory, operation, full_uri, 
+      extra_headers, data, chunked, rewind, replayable=False, 
+      connect_timeout=None, read_timeout=None, event=None, credentials=True):
+    try:
+      return __SendAndReceive(service, pool, pool_key, factory, operation, 
+          full_uri, extra_headers, data, chunked, rewind, replayable, 
+          connect_timeout, read_timeout, event, credentials)
+    except:
+      if event is not None:
+        event.error = sys.exc_info()[1]
+        event.fire(REQUEST_ERROR)
+      raise
+
+
+def __SendAndReceive(service, pool, pool_key, factory, operation, full_uri, 
+      extra_headers, data, chunked, rewind, replayable, connect_timeout, 
+      read_timeout, event, credentials=True):
+    # A pooled connection may have been closed by the server while it was idle.
+    # In that case the request is sent again over a new connection, provided
+    # that the data can be sent a second time. A request which was sent 
+    # completely may have been processed before the connection dropped, so it
+    # is only sent again if it is replayable (idempotent); otherwise the error
+    # is raised, for the RetryPolicy to decide.
+    fresh = False
+    while True:
+      if pool:
+        (connection, reused) = pool.acquire(pool_key, factory, fresh=fresh)
+      else:
+        (connection, reused) = (factory(), False)
+      sent = None
+      try:
+        __SetTimeouts(service, connection, connect_timeout, read_timeout, event)
+        sent = __SendRequest(service, connection, operation, full_uri, 
+            extra_headers, data, chunked, credentials)
+        if event is not None:
+          event.reused = reused
+          event.bytes_sent = sent
+          event.fire(REQUEST_SENT)
+        # Return the HTTP Response from the server.
+        response = connection.getresponse()
+        response.bytes_sent = sent
+      except (socket.error, httplib.HTTPException), e:
+        if pool:
+          pool.release(pool_key, connection, False)
+        # A timeout means the server is slow, not that the connection was stale.
+        if (reused and rewind is not None and not isinstance(e, socket.timeout)
+            and (replayable or sent is None)):
+          rewind()
+          fresh = True
+          continue
+        raise
+      if event is not None:
+        event.status = response.status
+        event.fire(FIRST_BYTE)
+        response = TimedResponse(response, event)
+      if pool:
+        response = PooledResponse(response, pool, pool_key, connection)
+      return DecodeResponse(response)
+
+
+def __SetTimeouts(service, connection, connect_timeout, read_timeout, 
+      event=None):
+    """Connects (if needed) within connect_timeout, and sets read_timeout as
+    the timeout of the socket."""
+    if connection.sock is None:
+      if connect_timeout is not None:
+        connection.timeout = connect_timeout
+      if event is None:
+        connection.connect()
+      else:
+        __TimedConnect(service, connection, event)
+    if read_timeout is None:
+      read_timeout = socket.getdefaulttimeout()
+    if hasattr(connection.sock, 'settimeout'):
+      connection.sock.settimeout(read_timeout)
+
+
+def __TimedConnect(service, connection, event):
+    """Connects, firing the DNS, CONNECT and TLS phases of event."""
+    dns_cache = getattr(service, 'dns_cache', None)
+    def Resolved():
+      event.fire(DNS)
+    def Create(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, 
+        source_address=None):
+      if dns_cache is not None:
+        sock = dns_cache.create_connection(address, timeout, source_address, 
+            Resolved)
+      else:
+        sock = CreateConnection(address, timeout, source_address, Resolved)
+      event.fire(CONNECT)
+      return sock
+    # httplib connects through this hook, see __NewConnection.
+    original = connection.__dict__.get('_create_connection')
+    connection._create_connection = Create
+    try:
+      connection.connect()
+    finally:
+      if original is None:
+        del connection._create_connection
+      else:
+        connection._create_connection = original
+    if isinstance(connection, httplib.HTTPSConnection):
+      event.fire(TLS)
+
+
+def __Min(timeout, remaining):
+    if timeout is None:
+      return remaining
+    return min(timeout, remaining)
+
+
+def __SendRequest(service, connection, operation, full_uri, extra_headers, 
+      data, chunked=False, credentials=True):
+    # Turn on debug mode if the debug member is set.
+    if service.debug:
+      connection.debuglevel = 1
+
+    connection.putrequest(operation, full_uri)
+
     # Send the HTTP headers.
     if isinstance(service.additional_headers, dict):
-      for header in service.additional_headers:
-        connection.putheader(header, service.additional_headers[header])
+      additional_headers = service.additional_headers
+      if not credentials:
+        additional_headers = __WithoutCredentials(additional_headers)
+      for header in additional_headers:
+        connection.putheader(header, additional_headers[header])
     if isinstance(extra_headers, dict):
       for header in extra_headers:
         connection.putheader(header, extra_headers[header])
     connection.endheaders()
 
     # If there is data, send it in the request.
+    sent = 0
     if data:
       if isinstance(data, list):
         for data_part in data:
-          __SendDataPart(data_part, connection)
+          sent += __SendDataPart(data_part, connection, chunked)
       else:
-        __SendDataPart(data, connection)
+        sent += __SendDataPart(data, connection, chunked)
+      if chunked:
+        # The last (zero-length) chunk ends the request body.
+        connection.send('0\r\n\r\n')
+    # The number of bytes of the body (without chunk framing).
+    return sent
+
 
-    # Return the HTTP Response from the server.
-    return connection.getresponse()
+def __WithoutCredentials(headers):
+    """Returns a copy of the headers dict without the CREDENTIAL_HEADERS."""
+    return dict([(header, value) for (header, value) in headers.items()
+                 if header.lower() not in CREDENTIAL_HEADERS])
 
 
-def __SendDataPart(data, connection):
+def __GetRewinder(data):
+    """Returns a function which makes data ready to be sent again.
+
+    Strings can always be sent again, file-like objects only if they can seek.
+    Returns None if the data can't be sent a second time.
+    """
+    if isinstance(data, list):
+      parts = data
+    else:
+      parts = [data]
+    positions = []
+    for part in parts:
+      if __IsIterator(part):
+        # Generators and other iterators can only be consumed once.
+        return None
+      if hasattr(part, 'read'):
+        if not (hasattr(part, 'seek') and hasattr(part, 'tell')):
+          return None
+        try:
+          positions.append((part, part.tell()))
+        except (IOError, OSError):
+          return None
+    def Rewind():
+      for (part, position) in positions:
+        part.seek(position)
+    return Rewind
+
+
+def __SendDataPart(data, connection, chunked=False):
+    """Sends data, returns the number of bytes sent."""
+    if chunked:
+      send = lambda binarydata: __SendChunk(binarydata, connection)
+    else:
+      send = connection.send
     if isinstance(data, str):
-      connection.send(data)
-      return
+      send(data)
+      return len(data)
     elif isinstance(data, unicode):
       # unicode string must be converted into 8-bit string version (otherwise httplib will raise UnicodeDecodeError)
-      connection.send(data.encode('utf-8'))
-      return
+      binarydata = data.encode('utf-8')
+      send(binarydata)
+      return len(binarydata)
     # NEXT SECTION COMMENTED OUT, replace by json.decode() if desired
     # elif ElementTree.iselement(data):
     #   connection.send(ElementTree.tostring(data))
     #   return
     # Check to see if data is a file-like object that has a read method.
     elif hasattr(data, 'read'):
-      # Read the file and send it a chunk at a time.
+      # Let the kernel copy regular files straight to plain sockets.
+      if not chunked:
+        sent = __SendFile(data, connection)
+        if sent is not None:
+          return sent
+      sent = 0
+      readinto = getattr(data, 'readinto', None)
+      if readinto is None:
+        # Read the file and send it a chunk at a time.
+        while 1:
+          binarydata = data.read(UPLOAD_BUFFER_SIZE)
+          if binarydata == '': break
+          send(binarydata)
+          sent += len(binarydata)
+        return sent
+      # Read the file into one buffer which is reused for every chunk.
+      buf = bytearray(UPLOAD_BUFFER_SIZE)
+      view = memoryview(buf)
       while 1:
-        binarydata = data.read(100000)
-        if binarydata == '': break
-        connection.send(binarydata)
-      return
+        size = readinto(buf)
+        if not size: break
+        send(view[:size])
+        sent += size
+      return sent
+    elif __IsIterable(data):
+      # Send the pieces produced by a generator or iterable as they come.
+      sent = 0
+      for binarydata in data:
+        if isinstance(binarydata, unicode):
+          binarydata = binarydata.encode('utf-8')
+        send(binarydata)
+        sent += len(binarydata)
+      return sent
     else:
       # The data object was not a file.
       # Try to convert to a string and send the data.
-      connection.send(str(data))
+      binarydata = str(data)
+      send(binarydata)
+      return len(binarydata)
+
+
+def __SendChunk(binarydata, connection):
+    # A zero-length chunk would end the body, so empty pieces are skipped.
+    if not len(binarydata):
       return
+    if isinstance(binarydata, str):
+      connection.send('%x\r\n%s\r\n' % (len(binarydata), binarydata))
+    else:
+      # Don't copy (large) buffers just to frame them.
+      connection.send('%x\r\n' % len(binarydata))
+      connection.send(binarydata)
+      connection.send('\r\n')
+
+
+def __SendFile(data, connection):
+    """Sends a regular file over a plain (non-TLS) socket with os.sendfile.
+
+    Returns the number of bytes sent, or None (without sending anything) if
+    sendfile can't be used for the data or the connection.
+    """
+    sendfile = getattr(os, 'sendfile', None)
+    sock = connection.sock
+    if sendfile is None or sock is None or type(sock) is not socket.socket:
+      return None
+    try:
+      in_fd = data.fileno()
+      if not stat.S_ISREG(os.fstat(in_fd).st_mode):
+        return None
+      start = offset = data.tell()
+    except (AttributeError, IOError, OSError, ValueError):
+      return None
+    out_fd = sock.fileno()
+    timeout = sock.gettimeout()
+    try:
+      while 1:
+        try:
+          sent = sendfile(out_fd, in_fd, offset, UPLOAD_BUFFER_SIZE * 16)
+        except OSError, e:
+          if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+            raise
+          # The socket has a timeout, so it is in non-blocking mode.
+          (readable, writable, errors) = select.select([], [out_fd], [], timeout)
+          if not writable:
+            raise socket.timeout('timed out')
+          continue
+        if sent == 0: break
+        offset += sent
+    finally:
+      data.seek(offset)
+    return offset - start
+
+
+def __IsIterable(data):
+    return (hasattr(data, '__iter__') and 
+        not isinstance(data, (basestring, dict)))
+
+
+def __IsIterator(data):
+    return hasattr(data, 'next') and not hasattr(data, 'read')
 
 
 def __CalculateDataLength(data):
@@ -408,10 +958,24 @@ def __CalculateDataLength(data):
     elif hasattr(data, 'read'):
       # If this is a file-like object, don't try to guess the length.
       return None
+    elif __IsIterable(data):
+      # Generators and other iterables are streamed, their length is unknown.
+      return None
     else:
       return len(str(data))
 
 
+def __AbsoluteUri(service, full_uri):
+    """Returns full_uri, which may be relative to the service's server, as an
+    absolute URI."""
+    (server, port, ssl, partial_uri) = ProcessUrl(service, full_uri)
+    if ssl:
+      scheme = 'https'
+    else:
+      scheme = 'http'
+    return NormalizeUri('%s://%s:%s%s' % (scheme, server, port, partial_uri))
+
+
 def PrepareConnection(service, full_uri):
     """Opens a connection to the server based on the full URI.
 
@@ -432,83 +996,105 @@ def PrepareConnection(service, full_uri):
       A tuple containing the httplib.HTTPConnection and the full_uri for the
       request.
     """
+    (pool_key, full_uri, factory) = __ConnectionParams(service, full_uri)
+    return (factory(), full_uri)
+
+
+def __ConnectionParams(service, full_uri):
+    """Determines how to connect to the server for the full URI.
 
+    Returns:
+      A tuple containing the (server, port, ssl, proxy, ssl_context, dns_cache)
+      key under which the connection can be pooled, the full_uri for the request and a function
+      which opens a new connection.
+    """
     (server, port, ssl, partial_uri) = ProcessUrl(service, full_uri)
     if ssl:
       # destination is https
       proxy = os.environ.get('https_proxy')
       if proxy:
-        (p_server, p_port, p_ssl, p_uri) = ProcessUrl(service, proxy, True)
-        proxy_username = os.environ.get('proxy-username')
-        if not proxy_username:
-          proxy_username = os.environ.get('proxy_username')
-        proxy_password = os.environ.get('proxy-password')
-        if not proxy_password:
-          proxy_password = os.environ.get('proxy_password')
+        # The connection to the proxy is turned into a tunnel (CONNECT) to the
+        # server, TLS is set up through it. The pool key includes the proxy,
+        # so established tunnels are reused like direct connections.
+        (p_server, p_port, p_ssl, p_uri) = ProcessUrl(service.server, proxy, True)
+        # Only the proxy sees these headers, they are sent with the CONNECT.
+        tunnel_headers = {}
+        if 'User-Agent' in service.additional_headers:
+          tunnel_headers['User-Agent'] = service.additional_headers['User-Agent']
+        (proxy_username, proxy_password) = __ProxyCredentials()
         if proxy_username:
-          user_auth = base64.encodestring('%s:%s' % (proxy_username,
-                                                     proxy_password))
-          proxy_authorization = ('Proxy-authorization: Basic %s\r\n' % (
-              user_auth.strip()))
-        else:
-          proxy_authorization = ''
-        proxy_connect = 'CONNECT %s:%s HTTP/1.0\r\n' % (server, port)
-        user_agent = 'User-Agent: %s\r\n' % (
-            service.additional_headers['User-Agent'])
-        proxy_pieces = (proxy_connect + proxy_authorization + user_agent
-                         + '\r\n')
-
-        #now connect, very simple recv and error checking
-        p_sock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
-        p_sock.connect((p_server,p_port))
-        p_sock.sendall(proxy_pieces)
-        response = ''
-
-        # Wait for the full response.
-        while response.find("\r\n\r\n") == -1:
-          response += p_sock.recv(8192)
-
-        p_status=response.split()[1]
-        if p_status!=str(200):
-          raise 'Error status=',str(p_status)
-
-        # Trivial setup for ssl socket.
-        ssl = socket.ssl(p_sock, None, None)
-        fake_sock = httplib.FakeSocket(p_sock, ssl)
-
-        # Initalize httplib and replace with the proxy socket.
-        connection = httplib.HTTPConnection(server)
-        connection.sock=fake_sock
-        full_uri = partial_uri
-
+          tunnel_headers['Proxy-Authorization'] = 'Basic %s' % (
+              base64.b64encode('%s:%s' % (proxy_username, proxy_password)),)
+        def factory():
+          connection = __NewConnection(service, httplib.HTTPSConnection,
+                                       p_server, p_port)
+          connection.set_tunnel(server, port, tunnel_headers)
+          return connection
       else:
-        connection = httplib.HTTPSConnection(server, port)
-        full_uri = partial_uri
+        def factory():
+          return __NewConnection(service, httplib.HTTPSConnection, server, port)
+      full_uri = partial_uri
 
     else:
       # destination is http
       proxy = os.environ.get('http_proxy')
       if proxy:
         (p_server, p_port, p_ssl, p_uri) = ProcessUrl(service.server, proxy, True)
-        proxy_username = os.environ.get('proxy-username')
-        if not proxy_username:
-          proxy_username = os.environ.get('proxy_username')
-        proxy_password = os.environ.get('proxy-password')
-        if not proxy_password:
-          proxy_password = os.environ.get('proxy_password')
+        (proxy_username, proxy_password) = __ProxyCredentials()
         if proxy_username:
           UseBasicAuth(service, proxy_username, proxy_password, True)
-        connection = httplib.HTTPConnection(p_server, p_port)
+        def factory():
+          return __NewConnection(service, httplib.HTTPConnection, p_server, p_port)
         if not full_uri.startswith("http://"):
           if full_uri.startswith("/"):
             full_uri = "http://%s%s" % (service.server, full_uri)
           else:
             full_uri = "http://%s/%s" % (service.server, full_uri)
       else:
-        connection = httplib.HTTPConnection(server, port)
+        def factory():
+          return __NewConnection(service, httplib.HTTPConnection, server, port)
         full_uri = partial_uri
 
-    return (connection, full_uri)
+    # Connections are only shared by services with the same SSL settings 
+    # (certificate checks, client certificate) and the same name resolution.
+    ssl_context = None
+    if ssl:
+      ssl_context = getattr(service, 'ssl_context', None)
+    dns_cache = getattr(service, 'dns_cache', None)
+    return ((server, port, ssl, proxy, ssl_context, dns_cache), full_uri, 
+        factory)
+
+
+def __NewConnection(service, connection_class, server, port):
+    """Creates an (unconnected) connection, which resolves server through the
+    service's DnsCache (if set) when it connects.
+
+    HTTPS connections use the service's SSLContext, or the shared default one,
+    so the CA certificates aren't loaded again for every connection.
+    """
+    context = None
+    if issubclass(connection_class, httplib.HTTPSConnection):
+      context = getattr(service, 'ssl_context', None) or GetDefaultContext()
+    if context is not None:
+      connection = connection_class(server, port, context=context)
+    else:
+      connection = connection_class(server, port)
+    dns_cache = getattr(service, 'dns_cache', None)
+    if dns_cache is not None:
+      # httplib connects (also for HTTPS) through this hook.
+      connection._create_connection = dns_cache.create_connection
+    return connection
+
+
+def __ProxyCredentials():
+    """Returns the (username, password) for the proxy from the environment."""
+    proxy_username = os.environ.get('proxy-username')
+    if not proxy_username:
+      proxy_username = os.environ.get('proxy_username')
+    proxy_password = os.environ.get('proxy-password')
+    if not proxy_password:
+      proxy_password = os.environ.get('proxy_password')
+    return (proxy_username, proxy_password)
 
 
 def UseBasicAuth(service, username, password, for_proxy=False):
@@ -652,11 +1238,12 @@ class MediaSource(object):
 
     Args:
       file_handle: A file handle pointing to the file to be encapsulated in the
-                   MediaSource
+                   MediaSource. This can also be a pipe or a generator (or
+                   another iterable) producing the data.
       content_type: string The MIME type of the file. Required if a file_handle
                     is given.
-      content_length: int The size of the file. Required if a file_handle is
-                      given.
+      content_length: int The size of the file. If None, the data is sent
+                      with chunked transfer-encoding.
       file_path: string (optional) A full path name to the file. Used in
                     place of a file_handle.
       file_name: string The name of the file without any path information.
@@ -689,13 +1276,37 @@ class MediaSource(object):
     self.content_length = os.path.getsize(file_name)
     self.file_name = os.path.basename(file_name)
 
-  def writeFile(self, file_path):
+  def writeFile(self, file_path, progress=None, buffer_size=None):
+    """Writes the data of the file_handle to a local file.
+
+    The data is copied in chunks of buffer_size bytes, so the file never has
+    to fit in memory. Afterwards content_length holds the number of bytes
+    written.
+
+    Args:
+      file_path: string The path of the local file.
+      progress: func (optional) Called as progress(bytes_written, total) after
+                every chunk, total is the content_length (which may be None).
+      buffer_size: int (optional) The size of the chunks, defaults to
+                   DOWNLOAD_BUFFER_SIZE.
+    """
     # can not write if no path and handle
     if not file_path or not self.file_handle:
         return False
     self.file_path = file_path
+    buffer_size = buffer_size or DOWNLOAD_BUFFER_SIZE
+    written = 0
     fd = open(file_path, 'wb')
-    fd.write(self.file_handle.read())  
-    fd.close()
+    try:
+        while 1:
+            binarydata = self.file_handle.read(buffer_size)
+            if not binarydata: break
+            fd.write(binarydata)
+            written += len(binarydata)
+            if progress:
+                progress(written, self.content_length)
+    finally:
+        fd.close()
+    self.content_length = written
     return True
 
@@ -0,0 +1,138 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 rambla.eu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Non-blocking variants of the RAWS services.
+
+  AsyncRawsService: Has the same request methods as RawsService (Get, Post,
+       Put, Delete, Head, ...) and the API methods of the service (e.g.
+       itemExists), but these calls return immediately with a Future. The
+       calls run on a bounded number of worker threads which share one
+       connection pool, so many requests can be in flight at the same time.
+       Other methods (deadline, span, iter_feed, set_credentials, ...) are
+       those of the wrapped service.
+
+  AsyncRassService, AsyncMetaService, AsyncRatsService, AsyncRamsService: The
+       same for the RASS, META, RATS and RAMS services.
+
+Example:
+  rass = AsyncRassService(USER, PWD, 'rass.cdn01.rambla.be', max_concurrency=64)
+  futures = [rass.itemExists(path) for path in paths]
+  for path, future in zip(paths, futures):
+    print path, future.result()
+  rass.close()
+"""
+from raws_json.connection_pool import ConnectionPool
+from raws_json.deadline import Bind
+from raws_json.tracing import Bind as BindSpan
+from raws_json.executor import WorkerPool
+from raws_json.raws_service import RawsService
+from raws_json.rass.service import RassService
+from raws_json.meta.service import MetaService
+from raws_json.rats.service import RatsService
+from raws_json.rams.service import RamsService
+
+
+class AsyncRawsService(object):
+  """Runs the methods of a RawsService in the background.
+
+  Calling a request method returns a raws_json.executor.Future, call its
+  result() method to wait for the return value (or the exception raised by the
+  call). Other members (server, port, username, deadline(), ...) are read from
+  and written to the wrapped service.
+  """
+
+  # The class of the wrapped (blocking) service.
+  service_class = RawsService
+
+  # Methods of RawsService which run in the background. The public methods
+  # which the subclasses of RawsService add (their API) do as well, except
+  # the iter_ generators.
+  request_methods = ('Get', 'Post', 'Put', 'PostOrPut', 'Delete', 'Head',
+                     'GetMedia', 'PostTxtFile', 'download')
+
+  def __init__(self, *args, **kwargs):
+    """Creates the wrapped service and the worker threads.
+
+    Takes the arguments of the constructor of service_class, plus:
+      max_concurrency: int (optional) Maximum number of requests in flight.
+      connection_pool: raws_json.ConnectionPool (optional) Pool shared by the
+          workers. By default a new pool is created which allows
+          max_concurrency connections per host.
+    """
+    max_concurrency = kwargs.pop('max_concurrency', 32)
+    connection_pool = kwargs.pop('connection_pool', None)
+    service = self.service_class(*args, **kwargs)
+    service.connection_pool = (connection_pool or
+        ConnectionPool(max_per_host=max_concurrency))
+    if service.metrics is not None:
+      service.metrics.add_pool(service.connection_pool)
+    self.__dict__['service'] = service
+    self.__dict__['executor'] = WorkerPool(max_concurrency)
+    self.__dict__['async_methods'] = _AsyncMethods(self.service_class,
+                                                   self.request_methods)
+
+  def __getattr__(self, name):
+    attr = getattr(self.service, name)
+    if name not in self.async_methods or not callable(attr):
+      return attr
+    executor = self.executor
+    def Submit(*args, **kwargs):
+      # The call runs under the Deadline and the Span (if any) of the calling
+      # thread.
+      return executor.submit(Bind(BindSpan(attr)), *args, **kwargs)
+    Submit.__name__ = name
+    Submit.__doc__ = attr.__doc__
+    return Submit
+
+  def __setattr__(self, name, value):
+    setattr(self.service, name, value)
+
+  def close(self, wait=True):
+    """Stops the worker threads (after the pending calls) and closes the idle
+    connections."""
+    self.executor.shutdown(wait)
+    if wait:
+      self.service.connection_pool.clear()
+
+
+def _AsyncMethods(service_class, request_methods):
+  """Returns the names of the methods of service_class which are run in the
+  background."""
+  names = set(request_methods)
+  for cls in service_class.__mro__:
+    if cls is RawsService or not issubclass(cls, RawsService):
+      continue
+    for (name, value) in vars(cls).items():
+      if (callable(value) and not name.startswith('_') and
+          not name.startswith('iter_')):
+        names.add(name)
+  return frozenset(names)
+
+
+class AsyncRassService(AsyncRawsService):
+  service_class = RassService
+
+
+class AsyncMetaService(AsyncRawsService):
+  service_class = MetaService
+
+
+class AsyncRatsService(AsyncRawsService):
+  service_class = RatsService
+
+
+class AsyncRamsService(AsyncRawsService):
+  service_class = RamsService
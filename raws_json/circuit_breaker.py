@@ -0,0 +1,180 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 rambla.eu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Stops sending requests to a server which keeps failing.
+
+  CircuitBreaker: Keeps a circuit per server. After a number of consecutive
+       failures (connection errors, 5xx responses or responses which took too
+       long) the circuit opens and requests to that server fail right away
+       with a CircuitOpenError. After recovery_timeout seconds, a limited
+       number of trial requests is let through (half-open): if they succeed
+       the circuit closes again, otherwise it stays open for another
+       recovery_timeout.
+"""
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpenError(Exception):
+  """Raised instead of sending a request to a server whose circuit is open."""
+  pass
+
+
+class _Circuit(object):
+
+  def __init__(self):
+    self.state = CLOSED
+    self.failures = 0
+    self.opened_at = 0
+    self.trials = 0
+
+
+class CircuitBreaker(object):
+  """Thread-safe circuit breaker, keyed by (server, port).
+
+  A CircuitBreaker can be shared by several services, so they all stop
+  sending requests to a failing server.
+
+  Example:
+    breaker = CircuitBreaker(failure_threshold=5, recovery_timeout=30)
+    rass.circuit_breaker = breaker
+    meta.circuit_breaker = breaker
+  """
+
+  def __init__(self, failure_threshold=5, recovery_timeout=30,
+               half_open_max_calls=1, slow_call_threshold=None,
+               failure_statuses=(500, 502, 503, 504)):
+    """Creates a new CircuitBreaker.
+
+    Args:
+      failure_threshold: int (optional) Number of consecutive failures after
+          which the circuit of a server opens.
+      recovery_timeout: float (optional) Seconds the circuit stays open
+          before trial requests are let through.
+      half_open_max_calls: int (optional) Maximum number of trial requests
+          in flight while the circuit is half-open.
+      slow_call_threshold: float (optional) A response which takes longer
+          than this number of seconds (up to its headers) counts as a failure.
+      failure_statuses: tuple (optional) Response statuses which count as
+          failures.
+    """
+    self.failure_threshold = failure_threshold
+    self.recovery_timeout = recovery_timeout
+    self.half_open_max_calls = half_open_max_calls
+    self.slow_call_threshold = slow_call_threshold
+    self.failure_statuses = failure_statuses
+    self._circuits = {}
+    self._lock = threading.Lock()
+
+  def acquire(self, key):
+    """Called before a request to the server key is sent.
+
+    Raises:
+      CircuitOpenError if the circuit is open, or half-open with the maximum
+      number of trial requests in flight.
+    """
+    self._lock.acquire()
+    try:
+      circuit = self._circuits.get(key)
+      if circuit is None or circuit.state == CLOSED:
+        return
+      if circuit.state == OPEN:
+        remaining = circuit.opened_at + self.recovery_timeout - time.time()
+        if remaining > 0:
+          raise CircuitOpenError('Circuit for %s:%s is open, retry in %.1f s'
+              % (key[0], key[1], remaining))
+        circuit.state = HALF_OPEN
+        circuit.trials = 0
+      if circuit.trials >= self.half_open_max_calls:
+        raise CircuitOpenError('Circuit for %s:%s is half-open, waiting for '
+            'trial requests' % (key[0], key[1]))
+      circuit.trials += 1
+    finally:
+      self._lock.release()
+
+  def record(self, key, status=None, elapsed=None):
+    """Called with the outcome of a request which was let through acquire().
+
+    Args:
+      key: The server the request was sent to.
+      status: int (optional) The status of the response, None if the request
+          failed without a response.
+      elapsed: float (optional) Number of seconds until the response arrived.
+    """
+    failed = (status is None or status in self.failure_statuses or
+              (self.slow_call_threshold is not None and elapsed is not None
+               and elapsed > self.slow_call_threshold))
+    self._lock.acquire()
+    try:
+      circuit = self._circuits.get(key)
+      if circuit is None:
+        if not failed:
+          return
+        circuit = self._circuits[key] = _Circuit()
+      if circuit.state == HALF_OPEN:
+        circuit.trials = max(circuit.trials - 1, 0)
+      if not failed:
+        if circuit.state != OPEN:
+          # A successful request (or trial) closes the circuit.
+          del self._circuits[key]
+        return
+      circuit.failures += 1
+      if (circuit.state == HALF_OPEN or
+          circuit.failures >= self.failure_threshold):
+        circuit.state = OPEN
+        circuit.opened_at = time.time()
+    finally:
+      self._lock.release()
+
+  def cancel(self, key):
+    """Called instead of record() when a request which was let through
+    acquire() wasn't sent, or failed for a reason unrelated to the server."""
+    self._lock.acquire()
+    try:
+      circuit = self._circuits.get(key)
+      if circuit is not None and circuit.state == HALF_OPEN:
+        circuit.trials = max(circuit.trials - 1, 0)
+    finally:
+      self._lock.release()
+
+  def state(self, key):
+    """Returns the state of the circuit for key: CLOSED, OPEN or HALF_OPEN."""
+    self._lock.acquire()
+    try:
+      circuit = self._circuits.get(key)
+      if circuit is None:
+        return CLOSED
+      if (circuit.state == OPEN and
+          time.time() >= circuit.opened_at + self.recovery_timeout):
+        return HALF_OPEN
+      return circuit.state
+    finally:
+      self._lock.release()
+
+  def reset(self, key=None):
+    """Closes the circuit for key, or all circuits."""
+    self._lock.acquire()
+    try:
+      if key is None:
+        self._circuits.clear()
+      else:
+        self._circuits.pop(key, None)
+    finally:
+      self._lock.release()
@@ -0,0 +1,281 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 rambla.eu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Persistent (keep-alive) connections for the RAWS services.
+
+  ConnectionPool: Keeps httplib connections keyed by (server, port, ssl, proxy,
+       ssl_context, dns_cache) so that consecutive requests to the same RAWS
+       node reuse the TCP (and TLS) connection instead of opening a new one
+       for every request.
+
+  PooledResponse: Wraps the httplib.HTTPResponse returned by HttpRequest and
+       hands the connection back to the pool once the body has been read.
+"""
+import select
+import socket
+import threading
+import time
+
+
+class PoolTimeout(Exception):
+  pass
+
+
+class ConnectionPool(object):
+  """Thread-safe pool of persistent HTTP connections.
+
+  Connections are grouped per key, which is a (server, port, ssl, proxy,
+  ssl_context, dns_cache) tuple.
+  At most max_per_host connections are handed out per key at the same time,
+  callers asking for more wait until one is released (or until
+  acquire_timeout seconds have passed). Idle connections are closed after
+  idle_timeout seconds and are checked for a dropped socket before reuse.
+  """
+
+  def __init__(self, max_per_host=10, max_idle_per_host=None, idle_timeout=60,
+               acquire_timeout=None):
+    """Creates a new ConnectionPool.
+
+    Args:
+      max_per_host: int (optional) Maximum number of connections (in use and
+          idle) per key.
+      max_idle_per_host: int (optional) Maximum number of idle connections
+          kept per key. Defaults to max_per_host.
+      idle_timeout: int (optional) Number of seconds an idle connection is kept
+          before it is closed.
+      acquire_timeout: float (optional) Maximum number of seconds to wait for
+          a free connection slot. None means wait forever.
+    """
+    self.max_per_host = max_per_host
+    self.max_idle_per_host = max_idle_per_host or max_per_host
+    self.idle_timeout = idle_timeout
+    self.acquire_timeout = acquire_timeout
+    self._cond = threading.Condition()
+    self._idle = {}
+    self._in_use = {}
+
+  def acquire(self, key, factory, fresh=False):
+    """Returns a (connection, reused) tuple for the given key.
+
+    Args:
+      key: tuple The (server, port, ...) key of the connection.
+      factory: callable Creates a new connection when no idle one is available.
+      fresh: bool (optional) If True, never hand out an idle connection.
+
+    Returns:
+      A tuple containing the connection and a bool which is True if the
+      connection has been used before.
+    """
+    deadline = None
+    if self.acquire_timeout is not None:
+      deadline = time.time() + self.acquire_timeout
+    self._cond.acquire()
+    try:
+      while True:
+        idle = self._idle.get(key)
+        while idle and not fresh:
+          (connection, last_used) = idle.pop()
+          if self._IsStale(connection, last_used):
+            self._Close(connection)
+            continue
+          self._in_use[key] = self._in_use.get(key, 0) + 1
+          return (connection, True)
+        if (fresh and idle and
+            self._in_use.get(key, 0) + len(idle) >= self.max_per_host):
+          # Make room for the new connection.
+          (connection, last_used) = idle.pop(0)
+          self._Close(connection)
+        if self._in_use.get(key, 0) + len(idle or []) < self.max_per_host:
+          self._in_use[key] = self._in_use.get(key, 0) + 1
+          break
+        if deadline is None:
+          self._cond.wait()
+        else:
+          remaining = deadline - time.time()
+          if remaining <= 0:
+            raise PoolTimeout('No free connection to %s:%s within %s seconds'
+                % (key[0], key[1], self.acquire_timeout))
+          self._cond.wait(remaining)
+    finally:
+      self._cond.release()
+
+    try:
+      connection = factory()
+    except:
+      self._Forget(key)
+      raise
+    return (connection, False)
+
+  def release(self, key, connection, reusable=True):
+    """Hands a connection back to the pool.
+
+    Args:
+      key: tuple The key which was used to acquire the connection.
+      connection: The httplib connection.
+      reusable: bool (optional) If False, the connection is closed instead of
+          being kept for the next request.
+    """
+    self._cond.acquire()
+    try:
+      self._in_use[key] = max(self._in_use.get(key, 0) - 1, 0)
+      idle = self._idle.setdefault(key, [])
+      if (reusable and connection.sock is not None and
+          len(idle) < self.max_idle_per_host):
+        idle.append((connection, time.time()))
+      else:
+        self._Close(connection)
+      self._EvictIdle()
+      self._cond.notify_all()
+    finally:
+      self._cond.release()
+
+  def stats(self):
+    """Returns a dict with an (in_use, idle) tuple with the number of
+    connections per key."""
+    self._cond.acquire()
+    try:
+      stats = {}
+      for key in set(self._in_use.keys() + self._idle.keys()):
+        stats[key] = (self._in_use.get(key, 0), len(self._idle.get(key, ())))
+      return stats
+    finally:
+      self._cond.release()
+
+  def clear(self):
+    """Closes all idle connections."""
+    self._cond.acquire()
+    try:
+      for idle in self._idle.values():
+        for (connection, last_used) in idle:
+          self._Close(connection)
+      self._idle = {}
+      self._cond.notify_all()
+    finally:
+      self._cond.release()
+
+  def _Forget(self, key):
+    self._cond.acquire()
+    try:
+      self._in_use[key] = max(self._in_use.get(key, 0) - 1, 0)
+      self._cond.notify_all()
+    finally:
+      self._cond.release()
+
+  def _EvictIdle(self):
+    """Closes idle connections which have not been used for idle_timeout."""
+    now = time.time()
+    for key, idle in self._idle.items():
+      while idle and now - idle[0][1] > self.idle_timeout:
+        (connection, last_used) = idle.pop(0)
+        self._Close(connection)
+      if not idle and not self._in_use.get(key):
+        del self._idle[key]
+
+  def _IsStale(self, connection, last_used):
+    if connection.sock is None:
+      return True
+    if time.time() - last_used > self.idle_timeout:
+      return True
+    # An idle keep-alive socket should have nothing to read. If it is readable
+    # the server has closed it (or sent garbage), so it can't be reused.
+    try:
+      return _Readable(connection.sock)
+    except (select.error, socket.error, ValueError):
+      return True
+
+  def _Close(self, connection):
+    try:
+      connection.close()
+    except (socket.error, EnvironmentError):
+      pass
+
+
+class PooledResponse(object):
+  """Wraps an httplib.HTTPResponse whose connection belongs to a pool.
+
+  The connection is returned to the pool once the complete body has been read,
+  or closed if the response is closed (or garbage collected) before that. All
+  other attributes (status, reason, getheader, ...) are those of the wrapped
+  response.
+  """
+
+  def __init__(self, response, pool, key, connection):
+    self._response = response
+    self._pool = pool
+    self._key = key
+    self._connection = connection
+    self._released = False
+    if connection.sock is None:
+      # The server closed the connection ('Connection: close'), so httplib
+      # already detached the response from it.
+      self._Release(False)
+    elif response.length == 0 and not response.chunked:
+      # Nothing to read (e.g. HEAD, 204, 304): free the connection right away.
+      response.read()
+      self._Release(True)
+
+  def __getattr__(self, name):
+    return getattr(self._response, name)
+
+  def read(self, amt=None):
+    try:
+      if amt is None:
+        data = self._response.read()
+      else:
+        data = self._response.read(amt)
+    except:
+      self._Release(False)
+      raise
+    if self._response.isclosed():
+      self._Release(True)
+    return data
+
+  def close(self):
+    if not self._released:
+      fully_read = self._response.isclosed()
+      self._response.close()
+      self._Release(fully_read)
+
+  def _Release(self, reusable):
+    if self._released:
+      return
+    self._released = True
+    self._pool.release(self._key, self._connection, reusable)
+
+  def __del__(self):
+    if '_response' not in self.__dict__:
+      return
+    try:
+      self.close()
+    except Exception:
+      pass
+
+
+def _Readable(sock):
+  """Returns whether sock has something to read (or has been closed), without
+  waiting.
+
+  poll() is used where it is available: select() can't handle file
+  descriptors >= FD_SETSIZE (1024), which a process with many open files
+  soon reaches.
+  """
+  if hasattr(select, 'poll'):
+    poller = select.poll()
+    poller.register(sock, select.POLLIN | select.POLLPRI | select.POLLERR |
+                    select.POLLHUP)
+    return bool(poller.poll(0))
+  (readable, writable, errors) = select.select([sock], [], [], 0)
+  return bool(readable)
@@ -0,0 +1,102 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 rambla.eu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Transparent decoding of compressed (gzip or deflate) response bodies.
+
+  DecodeResponse: Returns a response whose read() method yields the decoded
+       body, decompressing it incrementally while it is read from the socket.
+"""
+import zlib
+
+# Number of compressed bytes read from the socket at a time.
+DECODE_CHUNK_SIZE = 64 * 1024
+
+
+def DecodeResponse(response):
+    """Wraps response in a DecodedResponse if its body is compressed.
+
+    Returns the response itself if it has no (supported) Content-Encoding.
+    """
+    encoding = (response.getheader('Content-Encoding') or '').strip().lower()
+    if encoding in ('gzip', 'x-gzip', 'deflate'):
+      return DecodedResponse(response, encoding)
+    return response
+
+
+class DecodedResponse(object):
+  """Decompresses the body of a gzip or deflate encoded response.
+
+  The Content-Encoding and Content-Length headers of the wrapped response are
+  hidden, as they describe the compressed body. All other attributes (status,
+  reason, getheaders, ...) are those of the wrapped response.
+  """
+
+  def __init__(self, response, encoding):
+    self._response = response
+    self._encoding = encoding
+    if encoding == 'deflate':
+      self._decoder = zlib.decompressobj()
+    else:
+      self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    self._first = True
+    self._buffer = ''
+    self._eof = False
+
+  def __getattr__(self, name):
+    return getattr(self._response, name)
+
+  def getheader(self, name, default=None):
+    if name.lower() in ('content-encoding', 'content-length'):
+      return default
+    return self._response.getheader(name, default)
+
+  def read(self, amt=None):
+    if amt is None:
+      chunks = [self._buffer]
+      self._buffer = ''
+      while not self._eof:
+        chunks.append(self._ReadChunk())
+      return ''.join(chunks)
+    chunks = [self._buffer]
+    size = len(self._buffer)
+    while size < amt and not self._eof:
+      chunk = self._ReadChunk()
+      chunks.append(chunk)
+      size += len(chunk)
+    data = ''.join(chunks)
+    self._buffer = data[amt:]
+    return data[:amt]
+
+  def close(self):
+    self._buffer = ''
+    self._eof = True
+    self._response.close()
+
+  def _ReadChunk(self):
+    raw = self._response.read(DECODE_CHUNK_SIZE)
+    if not raw:
+      self._eof = True
+      return self._decoder.flush()
+    try:
+      data = self._decoder.decompress(raw)
+    except zlib.error:
+      if not (self._first and self._encoding == 'deflate'):
+        raise
+      # Some servers send a raw deflate stream, without the zlib header.
+      self._decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+      data = self._decoder.decompress(raw)
+    self._first = False
+    return data
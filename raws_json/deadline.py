@@ -0,0 +1,146 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 rambla.eu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Timeouts for single requests and deadlines for sequences of requests.
+
+  Timeout: The connect, read and total timeouts of a request.
+
+  Deadline: A point in time by which a sequence of requests (e.g. an upload
+       followed by the creation of a job) must be done. Used as a context
+       manager, the deadline applies to every request made by the current
+       thread within the with block, including nested deadlines (which can
+       only make it earlier).
+
+  Bind: Makes a function run under the deadline of the calling thread, when
+       it is executed on another (worker) thread.
+"""
+import threading
+import time
+
+
+class DeadlineExceeded(Exception):
+  """Raised when a request can't be sent (or retried) before the deadline."""
+  pass
+
+
+class Timeout(object):
+  """Connect, read and total timeouts, in seconds (None for no timeout).
+
+  connect: Maximum time to set up a new connection.
+  read: Maximum time to wait for (a part of) the response, this is the socket
+      timeout while sending the request and reading the response.
+  total: Maximum time for the whole call, including retries and redirects.
+  """
+
+  def __init__(self, connect=None, read=None, total=None):
+    self.connect = connect
+    self.read = read
+    self.total = total
+
+  def merge(self, override):
+    """Returns a Timeout with the values of override which aren't None.
+
+    Args:
+      override: Timeout, or a number which is used as connect and read
+          timeout, or None.
+    """
+    if override is None:
+      return self
+    if not isinstance(override, Timeout):
+      override = Timeout(connect=override, read=override)
+    return Timeout(_First(override.connect, self.connect),
+                   _First(override.read, self.read),
+                   _First(override.total, self.total))
+
+  def __repr__(self):
+    return 'Timeout(connect=%r, read=%r, total=%r)' % (self.connect, self.read,
+                                                       self.total)
+
+
+_local = threading.local()
+
+
+class Deadline(object):
+  """A point in time by which the requests of a thread must be done.
+
+  Example:
+    with Deadline(60):
+      src = rats.createSrc('movie.mp4', '/tmp/movie.mp4')
+      job = rats.createJob(...)
+  """
+
+  def __init__(self, seconds=None, at=None):
+    """Creates a Deadline seconds from now, or at the given time.time()."""
+    if at is None:
+      at = time.time() + seconds
+    self.at = at
+    self._outer = []
+
+  def remaining(self):
+    """Returns the number of seconds left (0 once the deadline has passed)."""
+    return max(self.at - time.time(), 0)
+
+  def expired(self):
+    return time.time() >= self.at
+
+  def check(self, what='request'):
+    """Raises DeadlineExceeded if the deadline has passed."""
+    if self.expired():
+      raise DeadlineExceeded('Deadline exceeded before %s' % what)
+
+  def __enter__(self):
+    current = Current()
+    self._outer.append(current)
+    if current is not None and current.at < self.at:
+      # A nested deadline can't extend the one it is nested in.
+      self.at = current.at
+    _local.deadline = self
+    return self
+
+  def __exit__(self, *exc_info):
+    _local.deadline = self._outer.pop()
+    return False
+
+
+def Current():
+  """Returns the Deadline of the current thread, or None."""
+  return getattr(_local, 'deadline', None)
+
+
+def Earliest(*deadlines):
+  """Returns the earliest of the given Deadlines (which may be None)."""
+  deadlines = [d for d in deadlines if d is not None]
+  if not deadlines:
+    return None
+  return min(deadlines, key=lambda d: d.at)
+
+
+def Bind(fn):
+  """Returns a function which calls fn under the Deadline of the calling
+  thread (if any), wherever it is executed."""
+  deadline = Current()
+  if deadline is None:
+    return fn
+  def Bound(*args, **kwargs):
+    with Deadline(at=deadline.at):
+      return fn(*args, **kwargs)
+  return Bound
+
+
+def _First(value, default):
+  if value is None:
+    return default
+  return value
@@ -0,0 +1,162 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 rambla.eu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""In-process cache of resolved host names.
+
+  DnsCache: Resolves host names with getaddrinfo() and remembers the
+       addresses for ttl seconds. New connections are spread over the
+       addresses of a host (round robin); an address which refuses a
+       connection is skipped for a while and the next one is tried.
+
+  CreateConnection: socket.create_connection() which reports when the host
+       name is resolved, used to time connections without a DnsCache.
+"""
+import socket
+import threading
+import time
+
+
+class _Entry(object):
+
+  def __init__(self, addresses, expires):
+    self.addresses = addresses
+    self.expires = expires
+    self.next = 0
+
+
+class DnsCache(object):
+  """Thread-safe cache of getaddrinfo() results.
+
+  The system resolver doesn't report the TTL of its answers, so addresses are
+  kept for a fixed ttl. If a host can't be resolved when its addresses have
+  expired, the expired addresses are used until the resolver answers again.
+  """
+
+  def __init__(self, ttl=60, failure_timeout=30):
+    """Creates a new DnsCache.
+
+    Args:
+      ttl: float (optional) Seconds during which resolved addresses are used.
+      failure_timeout: float (optional) Seconds during which an address to
+          which a connection failed is only tried after the other addresses.
+    """
+    self.ttl = ttl
+    self.failure_timeout = failure_timeout
+    self._entries = {}
+    self._failed = {}
+    self._lock = threading.Lock()
+
+  def resolve(self, host, port):
+    """Returns the getaddrinfo() tuples for host and port, in the order in
+    which they should be tried."""
+    key = (host, port)
+    self._lock.acquire()
+    try:
+      entry = self._entries.get(key)
+    finally:
+      self._lock.release()
+    if entry is None or time.time() >= entry.expires:
+      try:
+        addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+      except socket.gaierror:
+        if entry is None:
+          raise
+        addresses = entry.addresses
+      entry = _Entry(addresses, time.time() + self.ttl)
+      self._lock.acquire()
+      try:
+        self._entries[key] = entry
+      finally:
+        self._lock.release()
+    self._lock.acquire()
+    try:
+      # Round robin: start at the next address every time.
+      addresses = entry.addresses
+      start = entry.next % len(addresses)
+      entry.next += 1
+      addresses = addresses[start:] + addresses[:start]
+      now = time.time()
+      good = [a for a in addresses if self._failed.get(a[4], 0) <= now]
+      bad = [a for a in addresses if self._failed.get(a[4], 0) > now]
+      return good + bad
+    finally:
+      self._lock.release()
+
+  def create_connection(self, address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT,
+                        source_address=None, resolved=None):
+    """Like socket.create_connection(), but with cached addresses, see
+    resolve(). If given, resolved() is called once the addresses are known."""
+    (host, port) = address
+    addresses = self.resolve(host, port)
+    if resolved is not None:
+      resolved()
+    return _ConnectAny(host, addresses, timeout, source_address,
+                       self._MarkFailed)
+
+  def clear(self):
+    self._lock.acquire()
+    try:
+      self._entries.clear()
+      self._failed.clear()
+    finally:
+      self._lock.release()
+
+  def _MarkFailed(self, sockaddr):
+    self._lock.acquire()
+    try:
+      now = time.time()
+      for (address, until) in self._failed.items():
+        if until <= now:
+          del self._failed[address]
+      self._failed[sockaddr] = now + self.failure_timeout
+    finally:
+      self._lock.release()
+
+
+def CreateConnection(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT,
+                     source_address=None, resolved=None):
+  """Like socket.create_connection() (without caching), but calls resolved()
+  once the addresses are known."""
+  (host, port) = address
+  addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+  if resolved is not None:
+    resolved()
+  return _ConnectAny(host, addresses, timeout, source_address)
+
+
+def _ConnectAny(host, addresses, timeout, source_address, failed=None):
+  """Returns a socket connected to the first of addresses which accepts the
+  connection, failed(sockaddr) is called for the others."""
+  error = None
+  for (family, socktype, proto, canonname, sockaddr) in addresses:
+    sock = None
+    try:
+      sock = socket.socket(family, socktype, proto)
+      if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+        sock.settimeout(timeout)
+      if source_address:
+        sock.bind(source_address)
+      sock.connect(sockaddr)
+      return sock
+    except socket.error, e:
+      error = e
+      if sock is not None:
+        sock.close()
+      if failed is not None:
+        failed(sockaddr)
+  if error is not None:
+    raise error
+  raise socket.error('getaddrinfo returned an empty list for %s' % host)
@@ -0,0 +1,216 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 rambla.eu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Runs RAWS calls in the background on a bounded number of worker threads.
+
+  Future: The pending result of a call submitted to a WorkerPool.
+
+  WorkerPool: Executes submitted calls on at most max_workers threads.
+
+  as_completed: Generator which yields futures in the order they finish.
+"""
+import sys
+import threading
+import time
+import Queue
+
+
+class TimeoutError(Exception):
+  pass
+
+
+class Future(object):
+  """The pending result of a call which runs on a WorkerPool."""
+
+  def __init__(self):
+    self._cond = threading.Condition()
+    self._done = False
+    self._result = None
+    self._exc_info = None
+    self._callbacks = []
+
+  def done(self):
+    """Returns True if the call has finished."""
+    return self._done
+
+  def result(self, timeout=None):
+    """Waits for the call to finish and returns its result.
+
+    If the call raised an exception, the same exception is raised here.
+
+    Args:
+      timeout: float (optional) Maximum number of seconds to wait.
+    """
+    self._Wait(timeout)
+    if self._exc_info:
+      raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+    return self._result
+
+  def exception(self, timeout=None):
+    """Waits for the call to finish and returns the exception it raised, or
+    None if it succeeded."""
+    self._Wait(timeout)
+    if self._exc_info:
+      return self._exc_info[1]
+    return None
+
+  def add_done_callback(self, fn):
+    """Calls fn(future) once the call has finished (right away if it already
+    has)."""
+    self._cond.acquire()
+    try:
+      if not self._done:
+        self._callbacks.append(fn)
+        return
+    finally:
+      self._cond.release()
+    fn(self)
+
+  def set_result(self, result):
+    self._Finish(result, None)
+
+  def set_exc_info(self, exc_info):
+    self._Finish(None, exc_info)
+
+  def _Finish(self, result, exc_info):
+    self._cond.acquire()
+    try:
+      self._result = result
+      self._exc_info = exc_info
+      self._done = True
+      callbacks = self._callbacks
+      self._callbacks = []
+      self._cond.notify_all()
+    finally:
+      self._cond.release()
+    for fn in callbacks:
+      fn(self)
+
+  def _Wait(self, timeout):
+    self._cond.acquire()
+    try:
+      if timeout is None:
+        while not self._done:
+          self._cond.wait()
+      else:
+        deadline = time.time() + timeout
+        while not self._done:
+          remaining = deadline - time.time()
+          if remaining <= 0:
+            raise TimeoutError('Call did not finish within %s seconds' % timeout)
+          self._cond.wait(remaining)
+    finally:
+      self._cond.release()
+
+
+class WorkerPool(object):
+  """Executes calls on a bounded number of daemon worker threads.
+
+  Threads are started on demand, up to max_workers. Calls which are submitted
+  while all workers are busy wait in a queue.
+  """
+
+  def __init__(self, max_workers=16):
+    self.max_workers = max_workers
+    self._queue = Queue.Queue()
+    self._lock = threading.Lock()
+    self._workers = []
+    self._idle = 0
+    self._shutdown = False
+
+  def submit(self, fn, *args, **kwargs):
+    """Schedules fn(*args, **kwargs) and returns a Future for its result."""
+    future = Future()
+    self._lock.acquire()
+    try:
+      if self._shutdown:
+        raise RuntimeError('Cannot submit calls after shutdown()')
+      self._queue.put((future, fn, args, kwargs))
+      if (self._queue.qsize() > self._idle and
+          len(self._workers) < self.max_workers):
+        worker = threading.Thread(target=self._Work)
+        worker.daemon = True
+        self._workers.append(worker)
+        worker.start()
+    finally:
+      self._lock.release()
+    return future
+
+  def map(self, fn, *iterables):
+    """Like the built-in map(), but calls fn concurrently. Returns a list of
+    Futures in the order of the arguments."""
+    return [self.submit(fn, *args) for args in zip(*iterables)]
+
+  def shutdown(self, wait=True):
+    """Stops the workers once the queued calls have been executed."""
+    self._lock.acquire()
+    try:
+      self._shutdown = True
+      workers = list(self._workers)
+      for worker in workers:
+        self._queue.put(None)
+    finally:
+      self._lock.release()
+    if wait:
+      for worker in workers:
+        worker.join()
+
+  def _Work(self):
+    while True:
+      self._lock.acquire()
+      self._idle += 1
+      self._lock.release()
+      task = self._queue.get()
+      self._lock.acquire()
+      self._idle -= 1
+      self._lock.release()
+      if task is None:
+        return
+      (future, fn, args, kwargs) = task
+      try:
+        result = fn(*args, **kwargs)
+      except:
+        future.set_exc_info(sys.exc_info())
+      else:
+        future.set_result(result)
+      # Don't keep the last call (and its result) alive while waiting.
+      task = future = fn = args = kwargs = result = None
+
+
+def as_completed(futures, timeout=None):
+  """Yields the given futures as they finish.
+
+  Args:
+    futures: list of Future objects.
+    timeout: float (optional) Maximum number of seconds to wait in total.
+  """
+  finished = Queue.Queue()
+  futures = list(futures)
+  for future in futures:
+    future.add_done_callback(finished.put)
+  deadline = None
+  if timeout is not None:
+    deadline = time.time() + timeout
+  for i in range(len(futures)):
+    if deadline is None:
+      # A (long) timeout keeps the wait interruptible with Ctrl-C.
+      yield finished.get(True, 365 * 24 * 3600)
+    else:
+      try:
+        yield finished.get(True, max(deadline - time.time(), 0))
+      except Queue.Empty:
+        raise TimeoutError('%d calls did not finish within %s seconds'
+            % (len(futures) - i, timeout))
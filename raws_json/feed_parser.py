@@ -0,0 +1,227 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 rambla.eu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Incremental parser for (very large) RAWS json feeds.
+
+  FeedParser: Reads a json feed ({"feed": {..., "entry": [...]}}) from a
+       file-like object, such as an HTTP response, and yields the entries one
+       by one as soon as each of them has been received. Only the entry being
+       parsed is buffered, so memory use doesn't depend on the size of the
+       feed.
+"""
+import json
+import re
+
+# Number of bytes read from the file-like object at a time.
+PARSE_CHUNK_SIZE = 64 * 1024
+
+# Characters which matter while scanning a json value, outside strings (for
+# objects/arrays and for scalars respectively) and inside strings.
+_CONTAINER_CHARS = re.compile(r'[{}\[\]"]')
+_SCALAR_END_CHARS = re.compile(r'[{}\[\],:"\s]')
+_STRING_CHARS = re.compile(r'["\\]')
+_WHITESPACE = ' \t\r\n'
+
+
+class FeedParser(object):
+  """Iterates over the entries of a json feed while it is being read.
+
+  Each entry is yielded as an {"entry": entry} dict, like the entries of
+  raws_json.raws_service.Feed. Once all entries have been read, the feed
+  member holds the other (feed-level) elements of the feed, such as its links,
+  and document holds the complete document without the entries.
+
+  Example:
+    for entry in FeedParser(response):
+      print entry["entry"]["id"]
+  """
+
+  def __init__(self, fp, chunk_size=PARSE_CHUNK_SIZE):
+    """Creates a new FeedParser.
+
+    Args:
+      fp: A file-like object with a read(size) method.
+      chunk_size: int (optional) Number of bytes read at a time.
+    """
+    self.fp = fp
+    self.chunk_size = chunk_size
+    self.feed = {}
+    self.document = {}
+    self.done = False
+    self._buf = ''
+    self._pos = 0
+
+  def __iter__(self):
+    try:
+      for entry in self._Parse():
+        yield {"entry": entry}
+      # Read up to the end, so a pooled connection can be reused.
+      while self.fp.read(self.chunk_size):
+        pass
+    finally:
+      if not self.done and hasattr(self.fp, 'close'):
+        self.fp.close()
+
+  def _Parse(self):
+    self._Expect('{')
+    for key in self._Members():
+      if key == 'feed' and self._Peek() == '{':
+        self._pos += 1
+        for feed_key in self._Members():
+          if feed_key == 'entry' and self._Peek() == '[':
+            self._pos += 1
+            for value in self._Items():
+              yield json.loads(value)
+          elif feed_key == 'entry' and self._Peek() == '{':
+            # A feed with a single entry.
+            yield json.loads(self._ScanValue())
+          else:
+            self.feed[feed_key] = json.loads(self._ScanValue())
+        self.document['feed'] = self.feed
+      else:
+        self.document[key] = json.loads(self._ScanValue())
+    self.done = True
+
+  def _Members(self):
+    """Yields the keys of the object at the current position (after its '{').
+
+    The caller must consume the value of each key before asking for the next.
+    """
+    if self._Peek() == '}':
+      self._pos += 1
+      return
+    while True:
+      key = json.loads(self._ScanValue())
+      self._Expect(':')
+      self._Peek()
+      yield key
+      separator = self._Peek()
+      self._pos += 1
+      if separator == '}':
+        return
+      if separator != ',':
+        raise ValueError('Expected , or } in json feed, found %r' % separator)
+
+  def _Items(self):
+    """Yields the json text of each value of the array at the current
+    position (after its '[')."""
+    if self._Peek() == ']':
+      self._pos += 1
+      return
+    while True:
+      self._Peek()
+      yield self._ScanValue()
+      separator = self._Peek()
+      self._pos += 1
+      if separator == ']':
+        return
+      if separator != ',':
+        raise ValueError('Expected , or ] in json feed, found %r' % separator)
+
+  def _ScanValue(self):
+    """Returns the json text of the value at the current position and moves
+    past it."""
+    if self._Peek() not in '"{[':
+      return self._ScanScalar()
+    depth = 0
+    in_string = False
+    i = self._pos
+    while True:
+      if in_string:
+        m = _STRING_CHARS.search(self._buf, i)
+      else:
+        m = _CONTAINER_CHARS.search(self._buf, i)
+      if m is None or (m.group() == '\\' and m.end() >= len(self._buf)):
+        # Read more data, and continue scanning where we stopped (at the
+        # backslash if the escaped character is still missing).
+        if m is None:
+          offset = len(self._buf) - self._pos
+        else:
+          offset = m.start() - self._pos
+        if not self._Fill():
+          raise ValueError('Unexpected end of json feed')
+        i = self._pos + offset
+        continue
+      c = m.group()
+      i = m.end()
+      if in_string:
+        if c == '\\':
+          # Skip the escaped character.
+          i += 1
+        else:
+          in_string = False
+          if depth == 0:
+            return self._Take(i)
+      elif c == '"':
+        in_string = True
+      elif c in '{[':
+        depth += 1
+      else:
+        depth -= 1
+        if depth == 0:
+          return self._Take(i)
+
+  def _ScanScalar(self):
+    """Returns the text of the number, true, false or null at the current
+    position and moves past it."""
+    i = self._pos
+    while True:
+      m = _SCALAR_END_CHARS.search(self._buf, i)
+      if m is not None:
+        return self._Take(m.start())
+      offset = len(self._buf) - self._pos
+      if not self._Fill():
+        # A scalar at the very end of the document.
+        return self._Take(len(self._buf))
+      i = self._pos + offset
+
+  def _Take(self, end):
+    text = self._buf[self._pos:end]
+    self._pos = end
+    return text
+
+  def _Peek(self):
+    """Skips whitespace and returns the next character (without consuming
+    it)."""
+    while True:
+      buf = self._buf
+      n = len(buf)
+      i = self._pos
+      while i < n and buf[i] in _WHITESPACE:
+        i += 1
+      self._pos = i
+      if i < n:
+        return buf[i]
+      if not self._Fill():
+        raise ValueError('Unexpected end of json feed')
+
+  def _Expect(self, c):
+    found = self._Peek()
+    if found != c:
+      raise ValueError('Expected %r in json feed, found %r' % (c, found))
+    self._pos += 1
+
+  def _Fill(self):
+    """Reads the next chunk, dropping the data before the current position.
+
+    Returns False at the end of the data.
+    """
+    data = self.fp.read(self.chunk_size)
+    if not data:
+      return False
+    self._buf = self._buf[self._pos:] + data
+    self._pos = 0
+    return True
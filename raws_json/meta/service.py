@@ -97,6 +97,15 @@ class MetaService(RawsService):
             query.feed = uri
             uri = query.ToUri()
         return self.Get(uri = uri)
+
+    def iter_content_list(self, query = None, prefetch = 0):
+        """ Iterates over the content list, across all pages of the feed.
+
+            @param query raws_json.Query object that contains queryset args.
+            @param int prefetch : optional, number of pages fetched ahead in the background while the current page is processed.
+            @return generator yielding content entries (= {"entry": ...} dicts)
+        """
+        return self.iter_feed("/content/" + self.username + "/", query, prefetch = prefetch)
         
     def getContentInstance(self, name, query = None):
         """ Retrieves a content entry with name passed in the argument. 
@@ -130,6 +139,19 @@ class MetaService(RawsService):
             uri = query.ToUri()
         return self.Get(uri = uri)
 
+    def iter_content_dir_list(self, dirpath = None, query = None, prefetch = 0):
+        """ Iterates over a contentdir list, across all pages of the feed.
+
+            @param string Relative path to the directory from which to retrieve file info (None = root-dir).
+            @param query raws_json.Query object that contains queryset args.
+            @param int prefetch : optional, number of pages fetched ahead in the background while the current page is processed.
+            @return generator yielding content entries (virtual or real)
+        """
+        path = "/"
+        if dirpath:
+            path = "/" + dirpath.lstrip("/")
+        return self.iter_feed("/contentdir/" + self.username + path, query, prefetch = prefetch)
+
     def deleteContentDir(self, dirpath = None, delete_from_cdn = False, delete_files_only = False):
         """ Delete (recursively) all META file or/and content instances that are located under a given directory.
         
@@ -228,6 +250,15 @@ class MetaService(RawsService):
             uri = query.ToUri()
         return self.Get(uri = uri)
 
+    def iter_vocab_list(self, query = None, prefetch = 0):
+        """ Iterates over the vocab list, across all pages of the feed.
+
+            @param query raws_json.Query object that contains queryset args.
+            @param int prefetch : optional, number of pages fetched ahead in the background while the current page is processed.
+            @return generator yielding vocab entries (= {"entry": ...} dicts)
+        """
+        return self.iter_feed("/vocab/" + self.username + "/", query, prefetch = prefetch)
+
     def getVocabInstance(self, name):
         """ Retrieves a vocab entry with name passed in the argument. 
 
@@ -0,0 +1,357 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 rambla.eu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Request metrics of the RAWS services, in the Prometheus text format.
+
+  MetricsRegistry: Counts the requests of the services it instruments (through
+       their request hooks), per service, method, endpoint and status, and
+       keeps histograms of their latency and size. The connections of the
+       registered ConnectionPools are reported as gauges. render() returns
+       all metrics in the Prometheus text exposition format, serve() makes
+       them available on http://<address>:<port>/metrics.
+
+  Counter, Gauge, Histogram: The metrics kept by a MetricsRegistry.
+"""
+import BaseHTTPServer
+import SocketServer
+import threading
+import weakref
+from raws_json.request_hooks import (REQUEST_START, FIRST_BYTE,
+    TRANSFER_COMPLETE, REQUEST_ERROR)
+
+# Upper bounds of the buckets of the latency histograms, in seconds.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                    30, 60)
+
+# Upper bounds of the buckets of the size histograms, in bytes.
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304,
+                16777216, 67108864, 268435456, 1073741824)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Counter(object):
+  """A value per combination of labels, which only goes up."""
+
+  kind = 'counter'
+
+  def __init__(self, name, help, labelnames):
+    self.name = name
+    self.help = help
+    self.labelnames = tuple(labelnames)
+    self._values = {}
+    self._lock = threading.Lock()
+
+  def inc(self, labels, amount=1):
+    """Adds amount to the value for labels, a tuple with the label values."""
+    self._lock.acquire()
+    try:
+      self._values[labels] = self._values.get(labels, 0) + amount
+    finally:
+      self._lock.release()
+
+  def value(self, labels):
+    return self._values.get(labels, 0)
+
+  def samples(self):
+    """Returns a list of (name, labels, value) tuples, labels being a list of
+    (name, value) tuples."""
+    self._lock.acquire()
+    try:
+      values = sorted(self._values.items())
+    finally:
+      self._lock.release()
+    return [(self.name, zip(self.labelnames, labels), value)
+            for (labels, value) in values]
+
+
+class Gauge(Counter):
+  """A value per combination of labels, which goes up and down."""
+
+  kind = 'gauge'
+
+  def dec(self, labels, amount=1):
+    self.inc(labels, -amount)
+
+  def set(self, labels, value):
+    self._lock.acquire()
+    try:
+      self._values[labels] = value
+    finally:
+      self._lock.release()
+
+
+class Histogram(object):
+  """The distribution of observed values per combination of labels."""
+
+  kind = 'histogram'
+
+  def __init__(self, name, help, labelnames, buckets):
+    self.name = name
+    self.help = help
+    self.labelnames = tuple(labelnames)
+    self.buckets = tuple(sorted(buckets))
+    self._values = {}
+    self._lock = threading.Lock()
+
+  def observe(self, labels, value):
+    self._lock.acquire()
+    try:
+      counts = self._values.get(labels)
+      if counts is None:
+        # One count per bucket plus +Inf, then the sum.
+        counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0]
+      for (i, bound) in enumerate(self.buckets):
+        if value <= bound:
+          counts[i] += 1
+          break
+      else:
+        counts[len(self.buckets)] += 1
+      counts[-1] += value
+    finally:
+      self._lock.release()
+
+  def count(self, labels):
+    return sum(self._values.get(labels, [0])[:-1])
+
+  def samples(self):
+    self._lock.acquire()
+    try:
+      values = sorted((labels, list(counts))
+                      for (labels, counts) in self._values.items())
+    finally:
+      self._lock.release()
+    samples = []
+    for (labels, counts) in values:
+      labels = zip(self.labelnames, labels)
+      total = 0
+      for (bound, count) in zip(self.buckets + ('+Inf',), counts[:-1]):
+        total += count
+        samples.append((self.name + '_bucket',
+                        labels + [('le', _FormatValue(bound))], total))
+      samples.append((self.name + '_sum', labels, counts[-1]))
+      samples.append((self.name + '_count', labels, total))
+    return samples
+
+
+class MetricsRegistry(object):
+  """Metrics of the requests of the instrumented services.
+
+  Requests are counted per attempt: a retried request counts twice. Requests
+  which fail without a response get the status 'error'.
+
+  Example:
+    registry = MetricsRegistry()
+    registry.instrument(rass)
+    registry.serve(9100)
+  """
+
+  def __init__(self, prefix='raws', duration_buckets=DURATION_BUCKETS,
+               size_buckets=SIZE_BUCKETS):
+    """Creates a new MetricsRegistry.
+
+    Args:
+      prefix: str (optional) Prefix of the names of the metrics.
+      duration_buckets: tuple (optional) Bucket bounds of the latency
+          histograms, in seconds.
+      size_buckets: tuple (optional) Bucket bounds of the size histograms,
+          in bytes.
+    """
+    labels = ('service', 'method', 'endpoint')
+    self.requests = Counter(prefix + '_requests_total',
+        'Requests sent, by status.', labels + ('status',))
+    self.in_flight = Gauge(prefix + '_requests_in_flight',
+        'Requests which have been sent and whose response has not been read '
+        'yet.', ('service',))
+    self.duration = Histogram(prefix + '_request_duration_seconds',
+        'Time from the start of a request until its response has been read.',
+        labels, duration_buckets)
+    self.first_byte = Histogram(prefix + '_time_to_first_byte_seconds',
+        'Time from the start of a request until the response headers arrived.',
+        labels, duration_buckets)
+    self.request_size = Histogram(prefix + '_request_size_bytes',
+        'Size of the request bodies.', labels, size_buckets)
+    self.response_size = Histogram(prefix + '_response_size_bytes',
+        'Size of the response bodies, as received.', labels, size_buckets)
+    self.metrics = [self.requests, self.in_flight, self.duration,
+                    self.first_byte, self.request_size, self.response_size]
+    self._prefix = prefix
+    self._pools = []
+    self._instrumented = weakref.WeakKeyDictionary()
+    self._lock = threading.Lock()
+
+  def instrument(self, service, name=None):
+    """Records the requests of service, through its request_hooks.
+
+    Services keep no metrics unless they are instrumented, either with this
+    method or by passing the registry as the metrics argument of the
+    RawsService constructor. The registry becomes the metrics member of the
+    service, unless it already has one.
+
+    Args:
+      service: raws_json.JsonService The service, its request_hooks member
+          must be a raws_json.request_hooks.RequestHooks.
+      name: str (optional) The value of the service label, defaults to the
+          class name of the service.
+    """
+    if name is None:
+      name = service.__class__.__name__
+    self._lock.acquire()
+    try:
+      if service in self._instrumented:
+        return
+      hooks = ((REQUEST_START, lambda event: self.in_flight.inc((name,))),
+               (TRANSFER_COMPLETE, lambda event: self._Record(name, event)),
+               (REQUEST_ERROR, lambda event: self._Record(name, event)))
+      for (phase, hook) in hooks:
+        service.request_hooks.add(phase, hook)
+      self._instrumented[service] = (service.request_hooks, hooks)
+      if getattr(service, 'metrics', None) is None:
+        service.metrics = self
+    finally:
+      self._lock.release()
+
+  def uninstrument(self, service):
+    """Stops recording the requests of service."""
+    self._lock.acquire()
+    try:
+      (request_hooks, hooks) = self._instrumented.pop(service, (None, ()))
+      for (phase, hook) in hooks:
+        request_hooks.remove(phase, hook)
+      if getattr(service, 'metrics', None) is self:
+        service.metrics = None
+    finally:
+      self._lock.release()
+
+  def add_pool(self, pool, name=None):
+    """Reports the connections of a raws_json.ConnectionPool.
+
+    Args:
+      pool: The ConnectionPool.
+      name: str (optional) The value of the pool label, defaults to a number.
+    """
+    self._lock.acquire()
+    try:
+      for (known, known_name) in self._pools:
+        if known is pool:
+          return
+      if name is None:
+        name = str(len(self._pools))
+      self._pools.append((pool, name))
+    finally:
+      self._lock.release()
+
+  def pool_connections(self):
+    """Returns a Gauge with the number of connections of the registered
+    pools, by pool, server and state (in_use or idle)."""
+    self._lock.acquire()
+    try:
+      pools = list(self._pools)
+    finally:
+      self._lock.release()
+    connections = Gauge(self._prefix + '_pool_connections',
+        'Connections of the connection pools, by state.',
+        ('pool', 'server', 'state'))
+    for (pool, name) in pools:
+      for (key, (in_use, idle)) in pool.stats().items():
+        if not (in_use or idle):
+          continue
+        server = '%s:%s' % (key[0], key[1])
+        connections.inc((name, server, 'in_use'), in_use)
+        connections.inc((name, server, 'idle'), idle)
+    return connections
+
+  def render(self):
+    """Returns the metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in self.metrics + [self.pool_connections()]:
+      lines.append('# HELP %s %s' % (metric.name, metric.help))
+      lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+      for (name, labels, value) in metric.samples():
+        if labels:
+          name = '%s{%s}' % (name, ','.join(['%s="%s"' % (label,
+              _EscapeLabel(label_value)) for (label, label_value) in labels]))
+        lines.append('%s %s' % (name, _FormatValue(value)))
+    return '\n'.join(lines) + '\n'
+
+  def serve(self, port, address=''):
+    """Serves the metrics on http://address:port/metrics from a daemon thread.
+
+    Returns:
+      The BaseHTTPServer.HTTPServer, call its shutdown() method to stop it.
+    """
+    server = _MetricsServer((address, port), _MetricsHandler)
+    server.registry = self
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+  def _Record(self, name, event):
+    labels = (name, event.operation, event.uri_template)
+    status = event.status
+    if event.error is not None or status is None:
+      status = 'error'
+    self.requests.inc(labels + (str(status),))
+    self.in_flight.dec((name,))
+    duration = event.elapsed(TRANSFER_COMPLETE)
+    if duration is None:
+      duration = event.elapsed(REQUEST_ERROR)
+    if duration is not None:
+      self.duration.observe(labels, duration)
+    first_byte = event.elapsed(FIRST_BYTE)
+    if first_byte is not None:
+      self.first_byte.observe(labels, first_byte)
+    self.request_size.observe(labels, event.bytes_sent)
+    if event.complete:
+      self.response_size.observe(labels, event.bytes_received)
+
+
+class _MetricsServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+
+class _MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+  def do_GET(self):
+    if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+      self.send_error(404)
+      return
+    body = self.server.registry.render()
+    self.send_response(200)
+    self.send_header('Content-Type', CONTENT_TYPE)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+
+def _EscapeLabel(value):
+  if isinstance(value, unicode):
+    value = value.encode('utf-8')
+  return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+          .replace('\n', '\\n'))
+
+
+def _FormatValue(value):
+  if isinstance(value, float):
+    if value == int(value) and abs(value) < 1e15:
+      return str(int(value)) + '.0'
+    return repr(value)
+  return str(value)
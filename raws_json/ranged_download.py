@@ -0,0 +1,274 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 rambla.eu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Parallel, resumable downloads using HTTP range requests.
+
+  RangedDownload: Splits a file into segments which are fetched over separate
+       (pooled) connections and written at their offset into a preallocated
+       local file. Progress is recorded next to the partial file, so an
+       interrupted download can be resumed where each segment stopped, as
+       long as the remote file hasn't changed (same ETag or Last-Modified).
+"""
+import httplib
+import json
+import os
+import socket
+import threading
+
+import raws_json
+from raws_json.deadline import Bind
+from raws_json.tracing import Bind as BindSpan
+from raws_json.executor import WorkerPool
+
+# Suffix of the partial file, and of the file which records its progress.
+PARTIAL_SUFFIX = '.part'
+STATE_SUFFIX = '.part.json'
+
+# Record the progress of a segment after this many bytes.
+STATE_INTERVAL = 8 * 1024 * 1024
+
+
+class RangeError(Exception):
+  pass
+
+
+class RemoteChanged(RangeError):
+  """Raised when the remote file changed while (or since) it was partially
+  downloaded. The partial download is discarded, the next run starts over."""
+  pass
+
+
+class RangedDownload(object):
+  """Downloads the file at uri to local_path in segments.
+
+  Example:
+    RangedDownload(rass, url, '/tmp/master.mp4', segments=8, resume=True).run()
+  """
+
+  def __init__(self, service, uri, local_path, segments=4, resume=True,
+               progress=None, retries=3):
+    """Creates a new RangedDownload.
+
+    Args:
+      service: RawsService The service used to send the requests.
+      uri: string Relative or absolute URL of the file.
+      local_path: string Path of the local file.
+      segments: int (optional) Number of segments fetched in parallel.
+      resume: bool (optional) If True, continue a previous (interrupted)
+          download of the same file instead of starting over.
+      progress: func (optional) Called as progress(bytes_done, total).
+      retries: int (optional) Number of times a segment is requested again
+          (from where it stopped) after a connection error.
+    """
+    self.service = service
+    self.uri = uri
+    self.local_path = local_path
+    self.segments = max(int(segments), 1)
+    self.resume = resume
+    self.progress = progress
+    self.retries = retries
+    self.partial_path = local_path + PARTIAL_SUFFIX
+    self.state_path = local_path + STATE_SUFFIX
+    self.total = None
+    self.validator = None
+    self._ranges = []
+    self._flushed = []
+    self._lock = threading.Lock()
+
+  def run(self):
+    """Downloads the file and returns its size in bytes."""
+    (self.total, accept_ranges, self.validator) = self._Probe()
+    if self.total is None or not accept_ranges:
+      # No ranges: fall back to a single stream.
+      self.service.GetMedia(self.uri, file_path=self.partial_path,
+          progress=self.progress)
+      os.rename(self.partial_path, self.local_path)
+      return os.path.getsize(self.local_path)
+
+    self._ranges = self._LoadRanges()
+    self._flushed = [position for (start, position, end) in self._ranges]
+    self._Preallocate()
+    # From here on the partial file has its full size, so only the state
+    # tells which parts of it have been downloaded.
+    self._SaveState()
+    self._Report()
+    executor = WorkerPool(self.segments)
+    futures = [executor.submit(Bind(BindSpan(self._FetchRange)), i)
+               for (i, (start, position, end)) in enumerate(self._ranges)
+               if position <= end]
+    executor.shutdown(wait=False)
+    errors = [f.exception() for f in futures]
+    for error in errors:
+      if isinstance(error, RemoteChanged):
+        # The downloaded parts belong to another version of the file.
+        self._Discard()
+        raise error
+    self._SaveState()
+    for error in errors:
+      if error is not None:
+        # The state is saved, so a next call with resume=True continues here.
+        raise error
+    os.rename(self.partial_path, self.local_path)
+    if os.path.exists(self.state_path):
+      os.remove(self.state_path)
+    return self.total
+
+  def _Probe(self):
+    response = self.service.handler.HttpRequest(self.service, 'HEAD', None,
+        self.uri, extra_headers={'Accept-Encoding': 'identity'},
+        redirects_remaining=4)
+    response.read()
+    if response.status != 200:
+      raise RangeError('HEAD %s returned %s %s'
+          % (self.uri, response.status, response.reason))
+    content_length = response.getheader('Content-Length')
+    accept_ranges = (response.getheader('Accept-Ranges') or '').lower()
+    # Identifies the version of the file: a strong ETag, or else the
+    # Last-Modified date (weak ETags can't be used in If-Range).
+    validator = response.getheader('ETag')
+    if not validator or validator.startswith('W/'):
+      validator = response.getheader('Last-Modified')
+    if content_length is None:
+      return (None, False, validator)
+    return (int(content_length), 'bytes' in accept_ranges, validator)
+
+  def _LoadRanges(self):
+    """Returns a list of [start, position, end] lists, one per segment.
+
+    Progress is only taken from the state file: the partial file is
+    preallocated, so its size says nothing about what has been downloaded.
+    """
+    if (self.resume and self.validator and os.path.exists(self.partial_path)
+        and os.path.exists(self.state_path)):
+      try:
+        state = json.load(open(self.state_path))
+        if (state.get('size') == self.total and
+            state.get('validator') == self.validator):
+          return [list(r) for r in state['ranges']]
+      except (ValueError, KeyError, TypeError, IOError):
+        pass
+    return self._Split(0)
+
+  def _Split(self, offset):
+    remaining = self.total - offset
+    size = max(remaining // self.segments, 1)
+    ranges = []
+    start = offset
+    while start < self.total:
+      end = min(start + size, self.total) - 1
+      if len(ranges) == self.segments - 1:
+        end = self.total - 1
+      ranges.append([start, start, end])
+      start = end + 1
+    if offset > 0:
+      # Keep the completed prefix in the state.
+      ranges.insert(0, [0, offset, offset - 1])
+    return ranges
+
+  def _Preallocate(self):
+    if not os.path.exists(self.partial_path):
+      open(self.partial_path, 'wb').close()
+    fd = open(self.partial_path, 'r+b')
+    try:
+      fd.truncate(self.total)
+    finally:
+      fd.close()
+
+  def _FetchRange(self, index):
+    attempts = 0
+    while True:
+      try:
+        return self._FetchRangeOnce(index)
+      except (socket.error, httplib.HTTPException):
+        attempts += 1
+        if attempts > self.retries:
+          raise
+
+  def _FetchRangeOnce(self, index):
+    (start, position, end) = self._ranges[index]
+    if position > end:
+      return
+    headers = {'Range': 'bytes=%d-%d' % (position, end),
+               'Accept-Encoding': 'identity'}
+    if self.validator:
+      # The server sends the whole (new) file instead if it has changed.
+      headers['If-Range'] = self.validator
+    response = self.service.handler.HttpRequest(self.service, 'GET', None,
+        self.uri, extra_headers=headers, redirects_remaining=4)
+    if response.status == 200 and self.validator:
+      response.close()
+      raise RemoteChanged('%s changed during the download' % self.uri)
+    if response.status != 206:
+      response.read()
+      raise RangeError('GET %s (%s) returned %s %s'
+          % (self.uri, headers['Range'], response.status, response.reason))
+    fd = open(self.partial_path, 'r+b')
+    try:
+      fd.seek(position)
+      unsaved = 0
+      while position <= end:
+        binarydata = response.read(min(raws_json.DOWNLOAD_BUFFER_SIZE,
+                                       end - position + 1))
+        if not binarydata:
+          raise httplib.IncompleteRead('', end - position + 1)
+        fd.write(binarydata)
+        position += len(binarydata)
+        unsaved += len(binarydata)
+        self._lock.acquire()
+        try:
+          self._ranges[index][1] = position
+        finally:
+          self._lock.release()
+        if unsaved >= STATE_INTERVAL:
+          fd.flush()
+          self._flushed[index] = position
+          self._SaveState()
+          unsaved = 0
+        self._Report()
+    finally:
+      fd.close()
+      self._flushed[index] = position
+
+  def _SaveState(self):
+    self._lock.acquire()
+    try:
+      # Only record data which has been flushed to the partial file.
+      ranges = [[start, flushed, end] for ((start, position, end), flushed)
+                in zip(self._ranges, self._flushed)]
+      state = {'size': self.total, 'validator': self.validator,
+               'ranges': ranges}
+      fd = open(self.state_path + '.tmp', 'w')
+      try:
+        json.dump(state, fd)
+      finally:
+        fd.close()
+      os.rename(self.state_path + '.tmp', self.state_path)
+    finally:
+      self._lock.release()
+
+  def _Discard(self):
+    for path in (self.state_path, self.partial_path):
+      if os.path.exists(path):
+        os.remove(path)
+
+  def _Report(self):
+    if self.progress:
+      self._lock.acquire()
+      try:
+        done = sum(position - start for (start, position, end) in self._ranges)
+      finally:
+        self._lock.release()
+      self.progress(done, self.total)
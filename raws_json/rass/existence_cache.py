@@ -0,0 +1,124 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 rambla.eu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import threading
+import time
+from collections import OrderedDict
+
+from raws_json.raws_service import Feed
+
+
+class ExistenceCache(object):
+    """ Remembers for a while whether RASS items exist, so repeated HEAD checks on the same paths don't go to the server.
+
+        Paths are relative to the user's root on the CDN (as in RassService.itemExists). Both outcomes are cached:
+        the HTTP status 200 (exists) or 404 (doesn't exist).
+    """
+
+    def __init__(self, ttl = 60, negative_ttl = None, max_entries = 100000):
+        """ Constructor for ExistenceCache.
+
+        :param ttl: Seconds during which a 200 status is remembered (optional, default = 60)
+        :param negative_ttl: Seconds during which a 404 status is remembered (optional, default = ttl)
+        :param max_entries: Maximum number of paths remembered, the oldest are forgotten first (optional)
+        """
+        self.ttl = ttl
+        if negative_ttl is None:
+            negative_ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """ Returns the cached status (200 or 404) for path, or None if unknown or expired. """
+        path = _Normalize(path)
+        self._lock.acquire()
+        try:
+            cached = self._entries.get(path)
+            if cached is None:
+                return None
+            (status, expires) = cached
+            if time.time() >= expires:
+                del self._entries[path]
+                return None
+            return status
+        finally:
+            self._lock.release()
+
+    def set(self, path, status):
+        """ Records the status of a HEAD request for path. Only 200 and 404 are cached, other statuses make the cache forget path. """
+        path = _Normalize(path)
+        if status == 200:
+            ttl = self.ttl
+        elif status == 404:
+            ttl = self.negative_ttl
+        else:
+            self.forget(path)
+            return
+        self._lock.acquire()
+        try:
+            self._entries.pop(path, None)
+            self._entries[path] = (status, time.time() + ttl)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last = False)
+        finally:
+            self._lock.release()
+
+    def forget(self, path, prefix = False):
+        """ Forgets path, or every path starting with path if prefix is True (e.g. the content of a deleted dir). """
+        path = _Normalize(path)
+        self._lock.acquire()
+        try:
+            if prefix:
+                for key in [k for k in self._entries if k.startswith(path)]:
+                    del self._entries[key]
+            else:
+                self._entries.pop(path, None)
+        finally:
+            self._lock.release()
+
+    def prime(self, feed):
+        """ Records every item of a dir feed (result of RassService.getDirList) as existing.
+
+        :param feed: dir feed (= result of json.decode(response_body)) or raws_json.raws_service.Feed object
+        :return int : number of items recorded
+        """
+        if not isinstance(feed, Feed):
+            feed = Feed(feed)
+        count = 0
+        for item in feed:
+            params = (item["entry"].get("content") or {}).get("params") or {}
+            path = params.get("path")
+            if not path or params.get("kind") == "dir" or path.endswith("/"):
+                continue
+            self.set(path, 200)
+            count += 1
+        return count
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _Normalize(path):
+    return path.lstrip("/")
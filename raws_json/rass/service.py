@@ -17,18 +17,21 @@
 import json, os
 import raws_json
 from raws_json.raws_service import RawsService, Feed, Query, RequestError
+from raws_json.rass.existence_cache import ExistenceCache
 
 class RassService(RawsService):
 
-    def __init__(self, username, password, server, ssl = False):
+    def __init__(self, username, password, server, ssl = False, existence_cache = None):
         """ Constructor for RassService, used to send request to the RASS service.
 
         :param username: Name of your Rambla user account
         :param password: Pwd of your Rambla user account
         :param server: Domain name of the RASS service (either 'rass.cdn01.rambla.be' or 'rass.cdn02.rambla.be', depending on the subCDN you're using)
         :param ssl: Set True to use SSL (your account must be SSL enabled) (optional, default = False)
+        :param existence_cache: raws_json.rass.existence_cache.ExistenceCache which remembers the results of HEAD checks (optional, default = None: always send a HEAD request)
         """
         self.username = username
+        self.existence_cache = existence_cache
         super(RassService, self).__init__(username = username, password = password, server = server, ssl = ssl)
 
     def delete(self, uri):
@@ -38,10 +41,19 @@ class RassService(RawsService):
     def getItemHeader(self, uri):
         """ Does a HTTP HEAD request to RASS for the given URI and returns the status code.
 
+            If an existence_cache is set, a remembered status is returned without sending a request.
+
             @param string: URL of the item
             @return int : status code (200 or 404)
         """
+        path = self.__GetItemPath(uri)
+        if path is not None and self.existence_cache is not None:
+            status = self.existence_cache.get(path)
+            if status is not None:
+                return status
         http_resp = self.Head(uri = uri)
+        if path is not None and self.existence_cache is not None:
+            self.existence_cache.set(path, http_resp.status)
         return http_resp.status
 
     def getItemHeaderFromPath(self, path):
@@ -60,15 +72,19 @@ class RassService(RawsService):
 
             @param string dirpath : path to the directory (on the rambla CDN) in which the item needs to be created.
             @param string filename : proposed filename to be used when storing the file (RASS will append a suffix if file already exists on CDN).
-            @param string local_path : location of the file to be uploaded on the local machine
+            @param string local_path : location of the file to be uploaded on the local machine, or a file-like object (e.g. a pipe) or generator producing the data (streamed using chunked transfer-encoding).
             @param bool force_create : Not used.
             @return item object (= result of json.decode(response_body))
         """
         uri = "/item/" + dirpath.lstrip("/")
         if replace_existing:
             uri = uri + "?" + "replace=1"
-        media_source = raws_json.MediaSource(file_path = local_path, svr_filename = filename)
+        if isinstance(local_path, basestring):
+            media_source = raws_json.MediaSource(file_path = local_path, svr_filename = filename)
+        else:
+            media_source = raws_json.MediaSource(file_handle = local_path, file_name = filename)
         media_entry = self.Post(data = None, uri = uri, media_source = media_source)
+        self.__ItemCreated(media_entry)
         return media_entry
         
     def createItemFromString(self, dirpath, filename, data, replace_existing = False):
@@ -83,6 +99,7 @@ class RassService(RawsService):
         if replace_existing:
             uri = uri + "?" + "replace=1"
         media_entry = self.PostTxtFile(data = data, uri = uri, filename = filename)
+        self.__ItemCreated(media_entry)
         return media_entry
 
     def itemExists(self, path):
@@ -99,19 +116,36 @@ class RassService(RawsService):
             @param string: URL of the item
             @return bool : True if exists
         """
-        exists = False
-        http_resp = self.Head(uri = uri)
-        if http_resp.status == 200:
-            exists = True
-        return exists
+        return self.getItemHeader(uri = uri) == 200
         
+    def downloadItem(self, path, local_path, progress = None, segments = 1, resume = False):
+        """ Downloads a RASS item (= file on the CDN) to a local file.
+
+            The file is streamed to disk in fixed-size chunks, so memory use doesn't depend on the file size.
+
+            @param string path : relative path to the file on the CDN
+            @param string local_path : location on the local machine where the file will be stored
+            @param func progress : optional, called as progress(bytes_written, total) while downloading
+            @param int segments : optional, number of byte ranges fetched in parallel (over separate connections)
+            @param bool resume : optional, if True continue an interrupted download of the same file
+            @return int : number of bytes written
+        """
+        entry = self.Get(uri = "/item/" + path.lstrip("/"))
+        url = self.get_enclosure_link(entry)
+        if url is None:
+            raise RequestError, {'status': None, 'reason': 'Item has no enclosure link', 'body': path}
+        return self.download(url, local_path, progress = progress, segments = segments, resume = resume)
+
     def deleteItem(self, path):
         """ Deletes a RASS item (file on the CDN + RASS resource attached to it)
         
             @param string: relative path to the file on the cdn
         """
         uri = "/item/" + path.lstrip("/")
-        return self.delete(uri)
+        result = self.delete(uri)
+        if self.existence_cache is not None:
+            self.existence_cache.set(path, 404)
+        return result
 
     # DIR METHODS
     # -----------
@@ -156,7 +190,20 @@ class RassService(RawsService):
         if query:
             query.feed = uri
             uri = query.ToUri()
-        return self.Get(uri = uri)
+        feed = self.Get(uri = uri)
+        if self.existence_cache is not None:
+            self.existence_cache.prime(feed)
+        return feed
+
+    def iter_dir_list(self, path, query = None, prefetch = 0):
+        """ Iterates over the content of a directory, across all pages of the dir feed.
+
+            @param string : relative path to the directory to be retrieved
+            @param query raws_json.Query object that contains queryset args.
+            @param int prefetch : optional, number of pages fetched ahead in the background while the current page is processed.
+            @return generator yielding dir/item entries (= {"entry": ...} dicts)
+        """
+        return self.iter_feed("/dir/" + path.lstrip("/"), query, prefetch = prefetch)
 
     def deleteDir(self, path, recursive = False, files_only = False):
         """ Deletes a RASS dir (directory on the CDN)
@@ -179,7 +226,10 @@ class RassService(RawsService):
             query["files_only"] = "1"
             query.feed = uri
             uri = query.ToUri()
-        return self.delete(uri)
+        result = self.delete(uri)
+        if self.existence_cache is not None:
+            self.existence_cache.forget(path.rstrip("/") + "/", prefix = True)
+        return result
         
     # META METHODS
     # -----------
@@ -217,13 +267,36 @@ class RassService(RawsService):
         params = {"old_path":old, "new_path":new, "key":key}
         entry = {"entry":{"content":{"params":params},},}
         uri = "/move/%s/" % self.username
-        return self.Post(entry, uri= uri)
+        result = self.Post(entry, uri= uri)
+        if self.existence_cache is not None:
+            self.existence_cache.forget(old, prefix = True)
+            self.existence_cache.set(old, 404)
+            self.existence_cache.forget(new, prefix = True)
+        return result
 
     def copy(self, old, new, key):
         params = {"old_path":old, "new_path":new, "key":key}
         entry = {"entry":{"content":{"params":params},},}
         uri = "/copy/%s/" % self.username
-        return self.Post(entry, uri= uri)
+        result = self.Post(entry, uri= uri)
+        if self.existence_cache is not None:
+            self.existence_cache.forget(new, prefix = True)
+        return result
+
+    def __ItemCreated(self, item):
+        """ Records a newly created item (whose path may have a suffix appended by RASS) as existing. """
+        if self.existence_cache is not None:
+            try:
+                self.existence_cache.set(item["entry"]["content"]["params"]["path"], 200)
+            except (KeyError, TypeError):
+                pass
+
+    def __GetItemPath(self, uri):
+        """ Returns the path of the item that uri refers to, or None if uri isn't a RASS item URL. """
+        (server, port, ssl, partial_uri) = raws_json.ProcessUrl(self, uri)
+        if server != self.server or "?" in partial_uri or not partial_uri.startswith("/item/"):
+            return None
+        return partial_uri[len("/item/"):]
         
         
 
@@ -0,0 +1,199 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 rambla.eu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Client-side rate limiting, so bulk jobs stay below the RAWS account limits.
+
+  TokenBucket: Lets requests through at a steady rate, with bursts of up to
+       burst requests.
+
+  RateLimiter: Makes HttpRequest wait until a request may be sent. There is a
+       bucket for all requests, and optionally separate buckets for classes of
+       requests, by verb ('POST'), endpoint ('/job') or both ('POST /item').
+
+  GetAccountRateLimiter: Returns the RateLimiter shared by all services of
+       the same RAWS account.
+"""
+import threading
+import time
+import urlparse
+
+
+class RateLimitTimeout(Exception):
+  """Raised if a request can't be sent within the given timeout."""
+  pass
+
+
+class TokenBucket(object):
+  """Thread-safe token bucket.
+
+  Waiting requests reserve their tokens right away, so they are let through
+  in the order they arrived.
+  """
+
+  def __init__(self, rate, burst=None):
+    """Creates a new TokenBucket.
+
+    Args:
+      rate: float Number of tokens added per second.
+      burst: float (optional) Maximum number of tokens in the bucket,
+          defaults to rate (and at least 1).
+    """
+    self.rate = float(rate)
+    if burst is None:
+      burst = max(rate, 1)
+    self.burst = float(burst)
+    self._tokens = self.burst
+    self._updated = time.time()
+    self._lock = threading.Lock()
+
+  def reserve(self, tokens=1, timeout=None):
+    """Takes tokens from the bucket.
+
+    Returns:
+      The number of seconds to wait before they may be used.
+
+    Raises:
+      RateLimitTimeout if that would be longer than timeout seconds (the
+      tokens are not taken then).
+    """
+    self._lock.acquire()
+    try:
+      now = time.time()
+      self._tokens = min(self.burst,
+          self._tokens + (now - self._updated) * self.rate)
+      self._updated = now
+      wait = max(tokens - self._tokens, 0) / self.rate
+      if timeout is not None and wait > timeout:
+        raise RateLimitTimeout('Rate limit: request would wait %.1f s' % wait)
+      self._tokens -= tokens
+      return wait
+    finally:
+      self._lock.release()
+
+  def refund(self, tokens=1):
+    """Gives back tokens which were reserved but not used."""
+    self._lock.acquire()
+    try:
+      self._tokens = min(self.burst, self._tokens + tokens)
+    finally:
+      self._lock.release()
+
+  def acquire(self, tokens=1, timeout=None):
+    """Waits until tokens may be used, see reserve()."""
+    wait = self.reserve(tokens, timeout)
+    if wait > 0:
+      time.sleep(wait)
+
+
+class RateLimiter(object):
+  """Limits the rate of the requests of one or more services.
+
+  Example:
+    limiter = RateLimiter(rate=20, limits={'POST': 2, 'GET /job': (5, 10)})
+    rats.rate_limiter = limiter
+  """
+
+  def __init__(self, rate=10, burst=None, limits=None, classify=None):
+    """Creates a new RateLimiter.
+
+    Args:
+      rate: float (optional) Maximum number of requests per second, for all
+          requests together. None for no overall limit.
+      burst: float (optional) Number of requests which may be sent at once
+          after a quiet period, defaults to rate.
+      limits: dict (optional) Separate limits for classes of requests, which
+          apply on top of the overall limit. The keys are a verb ('POST'), an
+          endpoint ('/item') or both ('POST /item'); the values are a rate or
+          a (rate, burst) tuple. A request takes a token from the most
+          specific matching bucket only.
+      classify: func (optional) Called as classify(operation, uri) to get
+          the (verb, endpoint) of a request, the default uses the first
+          segment of the path of uri as the endpoint.
+    """
+    self.bucket = None
+    if rate is not None:
+      self.bucket = TokenBucket(rate, burst)
+    self.buckets = {}
+    for (key, limit) in (limits or {}).items():
+      if isinstance(limit, tuple):
+        self.buckets[key] = TokenBucket(*limit)
+      else:
+        self.buckets[key] = TokenBucket(limit)
+    self.classify = classify or Classify
+
+  def wait(self, operation, uri, timeout=None):
+    """Blocks until a request may be sent.
+
+    Args:
+      operation: str The HTTP method.
+      uri: str The (absolute) URI of the request.
+      timeout: float (optional) Maximum number of seconds to wait.
+
+    Raises:
+      RateLimitTimeout if the request can't be sent within timeout.
+    """
+    buckets = [b for b in (self.bucket, self.__ClassBucket(operation, uri))
+               if b is not None]
+    wait = 0
+    reserved = []
+    try:
+      for bucket in buckets:
+        wait = max(wait, bucket.reserve(1, timeout))
+        reserved.append(bucket)
+    except RateLimitTimeout:
+      for bucket in reserved:
+        bucket.refund(1)
+      raise
+    if wait > 0:
+      time.sleep(wait)
+
+  def __ClassBucket(self, operation, uri):
+    if not self.buckets:
+      return None
+    (verb, endpoint) = self.classify(operation, uri)
+    for key in ('%s %s' % (verb, endpoint), endpoint, verb):
+      if key in self.buckets:
+        return self.buckets[key]
+    return None
+
+
+def Classify(operation, uri):
+  """Returns the (verb, endpoint) of a request, e.g. ('GET', '/item')."""
+  path = urlparse.urlsplit(uri).path
+  return (operation, '/' + path.lstrip('/').split('/', 1)[0])
+
+
+# RateLimiters shared by the services of the same account.
+_account_limiters = {}
+_account_lock = threading.Lock()
+
+
+def GetAccountRateLimiter(username, *args, **kwargs):
+  """Returns the RateLimiter for the account username, creating it with the
+  given arguments (see RateLimiter) on the first call.
+
+  Example:
+    rass.rate_limiter = GetAccountRateLimiter(USER, rate=20)
+    meta.rate_limiter = GetAccountRateLimiter(USER)
+  """
+  _account_lock.acquire()
+  try:
+    limiter = _account_limiters.get(username)
+    if limiter is None:
+      limiter = _account_limiters[username] = RateLimiter(*args, **kwargs)
+    return limiter
+  finally:
+    _account_lock.release()
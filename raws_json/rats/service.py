@@ -14,9 +14,10 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.import os
-import json, os
+import json, os, time
 import raws_json
 from raws_json.raws_service import RawsService
+from raws_json.deadline import Deadline, DeadlineExceeded, Current
 
 class RatsService(RawsService):
     
@@ -60,11 +61,14 @@ class RatsService(RawsService):
         """ Tries to PUT a new src resource to RATS.
 
             @param filename filename to be given to the uploaded file on the RATS server.
-            @param local_path location of the file to be uploaded on the local machine
+            @param local_path location of the file to be uploaded on the local machine, or a file-like object (e.g. a pipe) or generator producing the data (streamed using chunked transfer-encoding).
 
             @return SrcEntry object
         """
-        media_source = raws_json.MediaSource(file_path = local_path, svr_filename = filename)
+        if isinstance(local_path, basestring):
+            media_source = raws_json.MediaSource(file_path = local_path, svr_filename = filename)
+        else:
+            media_source = raws_json.MediaSource(file_handle = local_path, file_name = filename)
         media_entry = self.Put(data = None, uri = '/src/', media_source = media_source)
         return media_entry
 
@@ -129,3 +133,54 @@ class RatsService(RawsService):
         if uri is None:
             raise Exception('You must provide a valid URI argument to getJob().')
         return self.Get(uri)
+
+    def waitForJob(self, uri, poll_interval = 10, timeout = None):
+        """ Polls a job until it has been processed completely (batch_status = 100).
+
+            @param uri path (relative or absolute) to the job instance.
+            @param poll_interval seconds between two polls (optional, default = 10)
+            @param timeout maximum number of seconds to wait, raises raws_json.deadline.DeadlineExceeded when exceeded (optional, default = no limit except the current deadline)
+            @return JobEntry object
+        """
+        with self.span("waitForJob", uri=uri):
+            if timeout is None:
+                return self.__PollJob(uri, poll_interval)
+            with Deadline(timeout):
+                return self.__PollJob(uri, poll_interval)
+
+    def encodeFile(self, filename, local_path, timeout = None, wait = False, poll_interval = 10, **job_args):
+        """ Uploads a src file and creates a job for it, optionally waiting until the job has been processed.
+
+            All requests (the upload, the job creation and the polls) share one deadline, and are traced as children of one span (if the service has a tracer).
+
+            @param filename filename to be given to the uploaded file on the RATS server.
+            @param local_path location of the file to be uploaded on the local machine, or a file-like object or generator (see createSrc).
+            @param timeout maximum number of seconds for the whole flow, raises raws_json.deadline.DeadlineExceeded when exceeded (optional)
+            @param wait if True, poll the job until it has been processed (optional, default = False)
+            @param poll_interval seconds between two polls (optional, default = 10)
+            @param job_args arguments for createJob() (format or formatgroup, output, tgt_location, ...), src_location is set to the uploaded src.
+            @return JobEntry object
+        """
+        with self.span("encodeFile", filename=filename):
+            if timeout is None:
+                return self.__EncodeFile(filename, local_path, wait, poll_interval, job_args)
+            with Deadline(timeout):
+                return self.__EncodeFile(filename, local_path, wait, poll_interval, job_args)
+
+    def __EncodeFile(self, filename, local_path, wait, poll_interval, job_args):
+        src = self.createSrc(filename, local_path)
+        job_args["src_location"] = src["entry"]["content"]["params"]["filename"]
+        job = self.createJob(**job_args)
+        if wait:
+            job = self.__PollJob(job["entry"]["id"], poll_interval)
+        return job
+
+    def __PollJob(self, uri, poll_interval):
+        job = self.getJob(uri)
+        while int(job["entry"]["content"]["params"]["batch_status"]) < 100:
+            deadline = Current()
+            if deadline is not None and deadline.remaining() < poll_interval:
+                raise DeadlineExceeded("Job %s was not processed before the deadline" % uri)
+            time.sleep(poll_interval)
+            job = self.getJob(uri)
+        return job
@@ -29,10 +29,20 @@ __author__ = 'api.jscudder (Jeffrey Scudder)'
                update.
 """
 import re
+import sys
 import httplib
+import threading
 import urllib
+import Queue
 import raws_json
 import json
+from raws_json.deadline import Deadline, Timeout, Bind
+from raws_json.executor import WorkerPool, as_completed
+from raws_json.feed_parser import FeedParser
+from raws_json.ranged_download import RangedDownload
+from raws_json.request_hooks import RequestHooks
+from raws_json.tracing import Bind as BindSpan, NULL_SPAN
+from raws_json.response_cache import ResponseCache
 
 # Module level variable specifies which module should be used by RawsService
 # objects to make HttpRequests. This setting can be overridden on each
@@ -66,13 +76,124 @@ class BadAuthenticationServiceURL(Error):
   pass
 
 
+class EntryView(object):
+    """Read-only {"entry": entry} mapping around an entry of a feed.
+
+    Behaves like the {"entry": entry} dict that single-entry responses decode
+    to, without allocating a dict for every entry of a feed.
+    """
+    __slots__ = ('entry',)
+
+    def __init__(self, entry):
+        self.entry = entry
+
+    def __getitem__(self, key):
+        if key == "entry":
+            return self.entry
+        raise KeyError(key)
+
+    def get(self, key, default = None):
+        if key == "entry":
+            return self.entry
+        return default
+
+    def has_key(self, key):
+        return key == "entry"
+
+    __contains__ = has_key
+
+    def keys(self):
+        return ["entry"]
+
+    def items(self):
+        return [("entry", self.entry)]
+
+    def __iter__(self):
+        return iter(["entry"])
+
+    def __len__(self):
+        return 1
+
+    def __eq__(self, other):
+        if isinstance(other, EntryView):
+            return self.entry == other.entry
+        return other == {"entry": self.entry}
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def to_dict(self):
+        """Returns a real {"entry": entry} dict."""
+        return {"entry": self.entry}
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
 class Feed(object):
+    """Lazy sequence view over a decoded json feed.
+
+    Iterating, indexing and slicing yield EntryView objects, which are created
+    on demand; nothing is copied from the decoded feed. Feed-level elements
+    (such as the paging links) are available through get(), links and
+    get_link().
+
+    Example:
+      feed_obj = Feed(rass.getDirList("mydir/"))
+      for item in feed_obj.entries:
+          print item["entry"]["id"]
+      next_uri = feed_obj.next_link
+    """
 
     def __init__(self, feed = None):
-        self.entries = []
-        if "entry" in feed["feed"]:
-            for e in feed["feed"]["entry"]:
-                self.entries.append({"entry":e,})
+        self.document = feed or {}
+        self.data = self.document.get("feed") or {}
+        entries = self.data.get("entry") or []
+        if isinstance(entries, dict):
+            # A feed with a single entry.
+            entries = [entries]
+        self._entries = entries
+
+    @property
+    def entries(self):
+        """The entries of the feed (the Feed itself is the sequence)."""
+        return self
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [EntryView(self._entries[i]) for i in xrange(*index.indices(len(self._entries)))]
+        return EntryView(self._entries[index])
+
+    def __iter__(self):
+        for e in self._entries:
+            yield EntryView(e)
+
+    def get(self, key, default = None):
+        """Returns a feed-level element (e.g. "link", "id", "updated")."""
+        return self.data.get(key, default)
+
+    @property
+    def links(self):
+        """The feed-level links, a list of dicts with (at least) rel and href."""
+        links = self.data.get("link") or []
+        if isinstance(links, dict):
+            links = [links]
+        return links
+
+    def get_link(self, rel):
+        """Returns the href of the feed-level link with the given rel, or None."""
+        for link in self.links:
+            if link.get("rel") == rel:
+                return link.get("href")
+        return None
+
+    @property
+    def next_link(self):
+        """The href of the next page of the feed, or None on the last page."""
+        return self.get_link("next")
 
 
 class RawsService(raws_json.JsonService):
@@ -83,7 +204,10 @@ class RawsService(raws_json.JsonService):
     """
     
     def __init__(self, username=None, password=None, source=None, server=None, port = None,
-               additional_headers=None, handler=None, ssl = False):
+               additional_headers=None, handler=None, ssl = False, connection_pool=None,
+               response_cache=None, retry_policy=None, circuit_breaker=None,
+               rate_limiter=None, timeout=None, ssl_context=None, request_hooks=None,
+               metrics=None, tracer=None):
         """Creates an object of type RawsService.
         
         Args:
@@ -94,6 +218,16 @@ class RawsService(raws_json.JsonService):
           additional_headers: dictionary (optional) Any additional headers which should be included with CRUD operations.
           handler: module (optional) The module whose HttpRequest function should be used when making requests to the server. The default value is atom.service.
           ssl: bool (optional) Use SSL encryption.
+          connection_pool: raws_json.ConnectionPool (optional) The pool from which persistent connections are taken. Defaults to raws_json.default_connection_pool, which is shared by all services.
+          response_cache: raws_json.response_cache.ResponseCache (optional) Cache for the responses of Get(). By default, responses are not cached.
+          retry_policy: raws_json.retry.RetryPolicy (optional) Retries failed requests with idempotent methods (and POSTs marked as idempotent). By default, requests are not retried.
+          circuit_breaker: raws_json.circuit_breaker.CircuitBreaker (optional) Makes requests to a failing server fail fast with a CircuitOpenError. Can be shared by several services.
+          rate_limiter: raws_json.rate_limit.RateLimiter (optional) Makes requests wait until they may be sent. Use raws_json.GetAccountRateLimiter(username) to share the limits of an account between services.
+          timeout: raws_json.deadline.Timeout or float (optional) Connect, read and total timeouts of every request (a number is used as connect and read timeout). By default, requests have no timeout.
+          ssl_context: ssl.SSLContext (optional) Context of the HTTPS connections, see raws_json.tls.CreateContext(). By default, one context is shared by all services.
+          request_hooks: raws_json.request_hooks.RequestHooks (optional) Hooks which are called at each phase of every request (DNS, connect, TLS, request sent, first byte, transfer complete), e.g. to measure latencies. Can be shared by several services. By default, the service has its own (empty) RequestHooks, see add_request_hook().
+          metrics: raws_json.metrics.MetricsRegistry (optional) Registry in which the requests of the service are counted (per method, endpoint and status) and timed, e.g. raws_json.default_metrics (which is shared by all services that pass it). By default, no metrics are kept and the requests are not timed.
+          tracer: raws_json.tracing.Tracer (optional) Records every request as a span and sends a traceparent header. By default, requests are not traced.
         """
         self.username = username
         self.password = password
@@ -101,6 +235,23 @@ class RawsService(raws_json.JsonService):
         self.additional_headers = additional_headers or {}
         self.handler = handler or http_request_handler
         self.ssl = ssl
+        self.connection_pool = connection_pool or raws_json.default_connection_pool
+        self.response_cache = response_cache
+        self.redirect_cache = raws_json.default_redirect_cache
+        self.dns_cache = raws_json.default_dns_cache
+        self.ssl_context = ssl_context
+        self.retry_policy = retry_policy
+        self.circuit_breaker = circuit_breaker
+        self.rate_limiter = rate_limiter
+        self.timeout = Timeout().merge(timeout)
+        if request_hooks is None:
+            request_hooks = RequestHooks()
+        self.request_hooks = request_hooks
+        self.metrics = None
+        if metrics:
+            metrics.instrument(self)
+            metrics.add_pool(self.connection_pool)
+        self.tracer = tracer
         if port:
             self.port = port
         elif ssl:
@@ -124,6 +275,27 @@ class RawsService(raws_json.JsonService):
         if self.username and self.password:
             self.UseBasicAuth(self.username, self.password)
 
+    def add_request_hook(self, phase, hook):
+        """Calls hook(event) at the given phase of every request of this service.
+
+        Args:
+          phase: string One of the phases in raws_json.request_hooks, e.g.
+              request_hooks.FIRST_BYTE.
+          hook: func Called with a raws_json.request_hooks.RequestEvent, which
+              has the timeit.default_timer() timestamps of the phases so far.
+              At request_hooks.REQUEST_START, it may still change event.headers.
+
+        Example:
+          def Ttfb(event):
+              print event.uri_template, event.elapsed(FIRST_BYTE, REQUEST_SENT)
+          meta.add_request_hook(FIRST_BYTE, Ttfb)
+        """
+        self.request_hooks.add(phase, hook)
+
+    def remove_request_hook(self, phase, hook):
+        """Removes a hook added with add_request_hook()."""
+        self.request_hooks.remove(phase, hook)
+
     def get_service_uri(self):
         base_uri = "http://" + self.server
         if self.port:
@@ -143,7 +315,7 @@ class RawsService(raws_json.JsonService):
   
   
     # CRUD operations
-    def Get(self, uri, extra_headers=None, redirects_remaining=4, encoding='UTF-8', converter=None):
+    def Get(self, uri, extra_headers=None, redirects_remaining=4, encoding='UTF-8', converter=None, timeout=None):
         """Query the Raws API with the given URI
 
         The uri is the portion of the URI after the server value
@@ -170,6 +342,13 @@ class RawsService(raws_json.JsonService):
               the server's results before it is returned. Example: use
               RawsFeedFromString to parse the server response as if it
               were a RawsFeed.
+          timeout: raws_json.deadline.Timeout or float (optional) Overrides
+              the timeouts of the service for this request.
+
+        If a response_cache is set, a fresh cached response is returned without
+        contacting the server, and a stale one is revalidated with a conditional
+        request (If-None-Match / If-Modified-Since). A 304 response returns the
+        cached body.
 
         Returns:
           If there is no ResultsTransformer specified in the call, a RawsFeed
@@ -178,36 +357,219 @@ class RawsService(raws_json.JsonService):
           return a string. If there is a ResultsTransformer, the returned value
           will be that of the ResultsTransformer function.
         """
-        if extra_headers is None:
-            extra_headers = {"Accept":"application/json"}
-        else:
-            extra_headers.update({"Accept":"application/json"})
+        # Copied, so the Accept header and the cache validators of this URI
+        # don't end up in the caller's dict (and in its next request).
+        extra_headers = dict(extra_headers or {})
+        extra_headers["Accept"] = "application/json"
+
+        cache = self.response_cache
+        if cache is not None:
+            cache_key = self.__CacheKey(uri)
+            cached = cache.lookup(cache_key)
+            if cached is not None:
+                if cached.is_fresh():
+                    return json.loads(cached.body)
+                for (header, value) in cached.validators().items():
+                    extra_headers.setdefault(header, value)
 
-        server_response = self.handler.HttpRequest(self, 'GET', None, uri, extra_headers=extra_headers)
+        server_response = self.handler.HttpRequest(self, 'GET', None, uri, extra_headers=extra_headers,
+            redirects_remaining=redirects_remaining, timeout=timeout)
         result_body = server_response.read()
 
+        if cache is not None:
+            if server_response.status == 304 and cached is not None:
+                cached = cache.refresh(cache_key, server_response) or cached
+                return json.loads(cached.body)
+            if server_response.status == 200:
+                cache.store(cache_key, server_response, result_body)
+
         if server_response.status == 200:
             return json.loads(s = result_body)
         else:
           raise RequestError, {'status': server_response.status,
               'reason': server_response.reason, 'body': result_body}
   
-    # def GetMedia(self, uri, extra_headers=None, file_path = None):
-    #     """Returns a MediaSource containing media and its metadata from the given
-    #     URI string, storing it into the local file_path.
-    #     """
-    #     response_handle = self.handler.HttpRequest(self, 'GET', None, uri, extra_headers=extra_headers)
-    #     if not response_handle:
-    #         raise rawsc.RawscException('Failed to retrieve response handle from URI = %s.' % str(uri))
-    #     media_source = rawsc.MediaSource(file_handle = response_handle, content_type = response_handle.getheader('Content-Type'), content_length = response_handle.getheader('Content-Length'))
-    #     if not media_source:
-    #         raise rawsc.RawscException('Failed to create media_source object after retrieving URI = %s.' % str(uri))
-    #     if file_path is not None:
-    #         if not media_source.writeFile(file_path):
-    #             raise rawsc.RawscException('Failed writing response (URI = %s) to path = %s.' % (str(uri), str(file_path)))
-    #     return media_source
-    #     
-    # 
+    def GetFeedStream(self, uri, extra_headers=None, redirects_remaining=4):
+        """Query the Raws API with the given URI and iterate over the entries of
+        the feed while it is being received.
+
+        Unlike Get(), the response is not buffered and decoded as a whole:
+        every entry is parsed and yielded as soon as it has been read from the
+        socket, so processing starts right away and memory use doesn't depend
+        on the size of the feed.
+
+        Example:
+          stream = meta.GetFeedStream('/contentdir/myuser/')
+          for entry in stream:
+              print entry["entry"]["id"]
+          links = stream.feed.get("link")
+
+        Args:
+          uri: string The query in the form of a URI. Example:
+               '/dir/mysubdir/?kind=file'.
+          extra_headers: dictionary (optional) Extra HTTP headers to be included
+                         in the GET request.
+          redirects_remaining: int (optional) Maximum number of redirects
+              which are followed, see Get().
+
+        Returns:
+          A raws_json.feed_parser.FeedParser, which yields {"entry": entry}
+          dicts. After the iteration, its feed member holds the feed-level
+          elements (links, ...).
+        """
+        extra_headers = dict(extra_headers or {})
+        extra_headers["Accept"] = "application/json"
+
+        server_response = self.handler.HttpRequest(self, 'GET', None, uri, extra_headers=extra_headers,
+            redirects_remaining=redirects_remaining)
+        if server_response.status != 200:
+            raise RequestError, {'status': server_response.status,
+                'reason': server_response.reason, 'body': server_response.read()}
+        return FeedParser(server_response)
+
+    def iter_feed(self, uri, query=None, extra_headers=None, prefetch=0):
+        """Iterates over the entries of a feed, across all of its pages.
+
+        Each page is streamed with GetFeedStream(), after its last entry the
+        feed's "next" link is followed, until a page has no such link. Only
+        one entry is held in memory at a time.
+
+        With prefetch > 0, a background thread reads ahead: while the entries
+        of page N are being processed, pages N+1 .. N+prefetch are fetched, so
+        the round trips are hidden. Up to prefetch + 1 decoded pages are then
+        held in memory.
+
+        Example:
+          for item in rass.iter_feed("/dir/mydir/", Query(params = {"kind":"file"})):
+              print item["entry"]["id"]
+
+        Args:
+          uri: string The URI of the first page. Example: '/dir/mysubdir/'.
+          query: raws_json.raws_service.Query (optional) Queryset args for the
+              first page.
+          extra_headers: dictionary (optional) Extra HTTP headers to be included
+                         in every GET request.
+          prefetch: int (optional) Number of pages to fetch ahead.
+
+        Returns:
+          A generator yielding {"entry": entry} dicts.
+        """
+        if query is not None:
+            query.feed = uri
+            uri = query.ToUri()
+        if prefetch > 0:
+            return self.__IterFeedPrefetch(uri, extra_headers, prefetch)
+        return self.__IterFeed(uri, extra_headers)
+
+    def __IterFeed(self, uri, extra_headers):
+        seen = set()
+        while uri and uri not in seen:
+            seen.add(uri)
+            stream = self.GetFeedStream(uri, extra_headers=dict(extra_headers or {}))
+            for entry in stream:
+                yield entry
+            uri = Feed({"feed": stream.feed}).next_link
+
+    def __IterFeedPrefetch(self, uri, extra_headers, prefetch):
+        pages = Queue.Queue(prefetch)
+        stop = threading.Event()
+
+        def Put(item):
+            # Give up when the consumer has stopped iterating.
+            while not stop.is_set():
+                try:
+                    pages.put(item, True, 0.5)
+                    return True
+                except Queue.Full:
+                    pass
+            return False
+
+        def Fetch(uri):
+            seen = set()
+            try:
+                while uri and uri not in seen and not stop.is_set():
+                    seen.add(uri)
+                    page = Feed(self.Get(uri, extra_headers=dict(extra_headers or {})))
+                    if not Put((page, None)):
+                        return
+                    uri = page.next_link
+                Put((None, None))
+            except:
+                Put((None, sys.exc_info()))
+
+        fetcher = threading.Thread(target=Bind(BindSpan(Fetch)), args=(uri,))
+        fetcher.daemon = True
+        fetcher.start()
+        try:
+            while True:
+                (page, exc_info) = pages.get()
+                if exc_info:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                if page is None:
+                    return
+                for entry in page:
+                    # The same {"entry": entry} dicts as GetFeedStream yields.
+                    yield entry.to_dict()
+        finally:
+            stop.set()
+
+    def GetMedia(self, uri, extra_headers=None, file_path=None, progress=None, redirects_remaining=4):
+        """Returns a MediaSource containing media and its metadata from the given
+        URI string.
+
+        If file_path is given, the media is streamed to that local file in
+        chunks of raws_json.DOWNLOAD_BUFFER_SIZE bytes, so memory use doesn't
+        depend on the size of the file. Otherwise the file_handle of the
+        returned MediaSource is the (unread) server response.
+
+        Args:
+          uri: string The relative or absolute URL of the media.
+          extra_headers: dictionary (optional) Extra HTTP headers to be included
+                         in the GET request.
+          file_path: string (optional) Local path to store the media into.
+          progress: func (optional) Called as progress(bytes_written, total)
+              after every chunk, total is None if the size is unknown.
+          redirects_remaining: int (optional) Maximum number of redirects
+              which are followed, see Get().
+
+        Returns:
+          A raws_json.MediaSource object.
+        """
+        response_handle = self.handler.HttpRequest(self, 'GET', None, uri, extra_headers=extra_headers,
+            redirects_remaining=redirects_remaining)
+        if response_handle.status != 200:
+            raise RequestError, {'status': response_handle.status,
+                'reason': response_handle.reason, 'body': response_handle.read()}
+        content_length = response_handle.getheader('Content-Length')
+        if content_length is not None:
+            content_length = int(content_length)
+        media_source = raws_json.MediaSource(file_handle = response_handle, content_type = response_handle.getheader('Content-Type'), content_length = content_length)
+        if file_path is not None:
+            if not media_source.writeFile(file_path, progress=progress):
+                raise Error('Failed writing response (URI = %s) to path = %s.' % (str(uri), str(file_path)))
+        return media_source
+
+    def download(self, uri, local_path, extra_headers=None, progress=None, segments=1, resume=False):
+        """Streams the media at the given URI to a local file, see GetMedia().
+
+        With segments > 1 or resume set, the file is fetched with HTTP range
+        requests, see raws_json.ranged_download.RangedDownload.
+
+        Args:
+          segments: int (optional) Number of parts fetched in parallel, each
+              over its own connection.
+          resume: bool (optional) Continue an interrupted download of the same
+              file instead of starting over.
+
+        Returns:
+          The number of bytes written to local_path.
+        """
+        with self.span("download", uri=uri, segments=segments):
+            if segments > 1 or resume:
+                return RangedDownload(self, uri, local_path, segments=segments, resume=resume, progress=progress).run()
+            media_source = self.GetMedia(uri, extra_headers=extra_headers, file_path=local_path, progress=progress)
+            return media_source.content_length
+
     # def GetEntry(self, uri, extra_headers=None):
     #     """Query the Raws API with the given URI and receive an Entry.
     # 
@@ -287,7 +649,7 @@ class RawsService(raws_json.JsonService):
     # 
     def Post(self, data, uri, extra_headers=None, url_params=None,
            escape_params=True, redirects_remaining=4, media_source=None,
-           converter=None):
+           converter=None, idempotent=False, timeout=None):
         """Insert or update  data into a Raws service at the given URI.
     
         Args:
@@ -313,6 +675,11 @@ class RawsService(raws_json.JsonService):
               server's response. Often this is a function like
               RawsEntryFromString which will parse the body of the server's
               response and return a RawsEntry.
+          idempotent: boolean (optional) If true, the POST may be sent again
+              according to the retry_policy, e.g. because it carries a
+              client-generated key which the server deduplicates.
+          timeout: raws_json.deadline.Timeout or float (optional) Overrides
+              the timeouts of the service for this request.
     
         Returns:
           If the post succeeded, this method will return a RawsFeed, RawsEntry,
@@ -322,11 +689,12 @@ class RawsService(raws_json.JsonService):
         return self.PostOrPut('POST', data, uri, extra_headers=extra_headers,
             url_params=url_params, escape_params=escape_params,
             redirects_remaining=redirects_remaining,
-            media_source=media_source, converter=converter)
+            media_source=media_source, converter=converter,
+            idempotent=idempotent, timeout=timeout)
       
     def PostOrPut(self, verb, data, uri, extra_headers=None, url_params=None,
            escape_params=True, redirects_remaining=4, media_source=None,
-           converter=None):
+           converter=None, idempotent=None, timeout=None):
         """Insert data into a Raws service at the given URI.
     
         Args:
@@ -348,11 +716,18 @@ class RawsService(raws_json.JsonService):
                          method will escape the query and any URL parameters
                          provided.
           media_source: MediaSource (optional) Container for the media to be sent
-              along with the entry, if provided.
+              along with the entry, if provided. If its content_length is None
+              (e.g. a pipe or a generator), the media is streamed using chunked
+              transfer-encoding.
           converter: func (optional) A function which will be executed on the
               server's response. Often this is a function like
               RawsEntryFromString which will parse the body of the server's
               response and return a RawsEntry.
+          idempotent: boolean (optional) Whether the request may be retried
+              according to the retry_policy. By default PUT requests are
+              retried and POST requests are not.
+          timeout: raws_json.deadline.Timeout or float (optional) Overrides
+              the timeouts of the service for this request.
     
         Returns:
           If the post succeeded, this method will return a RawsFeed, RawsEntry,
@@ -378,38 +753,47 @@ class RawsService(raws_json.JsonService):
             multipart.append('\r\n--END_OF_PART--\r\n')
     
             extra_headers['MIME-version'] = '1.0'
-            extra_headers['Content-Length'] = str(len(multipart[0]) +
-              len(multipart[1]) + len(multipart[2]) +
-              len(data_str) + media_source.content_length)
+            if media_source.content_length is not None:
+                extra_headers['Content-Length'] = str(len(multipart[0]) +
+                  len(multipart[1]) + len(multipart[2]) +
+                  len(data_str) + media_source.content_length)
     
             server_response = self.handler.HttpRequest(self, verb,
               [multipart[0], data_str, multipart[1], media_source.file_handle,
                   multipart[2]], uri,
               extra_headers=extra_headers, url_params=url_params,
               escape_params=escape_params,
-              content_type='multipart/related; boundary=END_OF_PART')
+              content_type='multipart/related; boundary=END_OF_PART',
+              redirects_remaining=redirects_remaining, idempotent=idempotent,
+              timeout=timeout)
             result_body = server_response.read()
     
         elif media_source or isinstance(data, raws_json.MediaSource):
             if isinstance(data, raws_json.MediaSource):
                 media_source = data
-            extra_headers['Content-Length'] = str(media_source.content_length)
+            # Without a content_length, the media is sent with chunked transfer-encoding
+            if media_source.content_length is not None:
+                extra_headers['Content-Length'] = str(media_source.content_length)
             extra_headers['Slug'] = str(media_source.svr_filename)
             server_response = self.handler.HttpRequest(self, verb,
               media_source.file_handle, uri, extra_headers=extra_headers,
               url_params=url_params, escape_params=escape_params,
-              content_type=media_source.content_type)
+              content_type=media_source.content_type,
+              redirects_remaining=redirects_remaining, idempotent=idempotent,
+              timeout=timeout)
             result_body = server_response.read()
     
         else:
-            http_data = json.dumps(data)
+            http_data = json.dumps(data, default=_JsonDefault)
             content_type = 'application/json'
             server_response = self.handler.HttpRequest(self, verb,
               http_data, uri, extra_headers=extra_headers,
               url_params=url_params, escape_params=escape_params,
-              content_type=content_type)
+              content_type=content_type, redirects_remaining=redirects_remaining,
+              idempotent=idempotent, timeout=timeout)
             result_body = server_response.read()
     
+        self.__InvalidateCache(uri, url_params, escape_params)
         # Server returns 201 for most post requests, but when performing a batch
         # request the server responds with a 200 on success.
         if server_response.status == 201 or server_response.status == 200:
@@ -419,7 +803,7 @@ class RawsService(raws_json.JsonService):
       
     def Put(self, data, uri, extra_headers=None, url_params=None,
           escape_params=True, redirects_remaining=3, media_source=None,
-          converter=None):
+          converter=None, timeout=None):
         """Updates an entry at the given URI.
     
         Args:
@@ -452,9 +836,9 @@ class RawsService(raws_json.JsonService):
         return self.PostOrPut('PUT', data, uri, extra_headers=extra_headers,
             url_params=url_params, escape_params=escape_params,
             redirects_remaining=redirects_remaining,
-            media_source=media_source, converter=converter)
+            media_source=media_source, converter=converter, timeout=timeout)
       
-    def Delete(self, uri, extra_headers=None, url_params=None, escape_params=True, redirects_remaining=4):
+    def Delete(self, uri, extra_headers=None, url_params=None, escape_params=True, redirects_remaining=4, timeout=None):
         """Deletes the entry at the given URI.
     
         Args:
@@ -481,8 +865,10 @@ class RawsService(raws_json.JsonService):
     
         server_response = self.handler.HttpRequest(self, 'DELETE', None, uri,
             extra_headers=extra_headers, url_params=url_params,
-            escape_params=escape_params)
+            escape_params=escape_params, redirects_remaining=redirects_remaining,
+            timeout=timeout)
         result_body = server_response.read()
+        self.__InvalidateCache(uri, url_params, escape_params)
     
         if server_response.status == 204:
             return True
@@ -501,8 +887,9 @@ class RawsService(raws_json.JsonService):
         extra_headers['Slug'] = str(filename)
         content_type = 'application/data'
         server_response = self.handler.HttpRequest(self, "POST", data, uri, extra_headers=extra_headers, url_params=url_params, escape_params=escape_params,
-                                                  content_type=content_type)
+                                                  content_type=content_type, redirects_remaining=redirects_remaining)
         result_body = server_response.read()
+        self.__InvalidateCache(uri, url_params, escape_params)
         # Server returns 201 for most post requests, but when performing a batch
         # request the server responds with a 200 on success.
         if server_response.status == 201 or server_response.status == 200:
@@ -510,6 +897,125 @@ class RawsService(raws_json.JsonService):
         else:
             raise RequestError, {'status': server_response.status, 'reason': server_response.reason, 'body': result_body}
 
+    # Response cache
+    def __CacheKey(self, uri, url_params=None, escape_params=True):
+        full_uri = raws_json.BuildUri(uri, url_params, escape_params)
+        (server, port, ssl, partial_uri) = raws_json.ProcessUrl(self, full_uri)
+        return (self.username, server, int(port), ssl, partial_uri)
+
+    def __InvalidateCache(self, uri, url_params=None, escape_params=True):
+        """Drops the cached responses for uri, whatever their query string,
+        for everything below it (e.g. the items of a deleted dir) and for the
+        listing of its parent."""
+        if self.response_cache is None:
+            return
+        key = self.__CacheKey(uri, url_params, escape_params)
+        path = key[4].split('?')[0]
+        parent = path.rstrip('/').rsplit('/', 1)[0] + '/'
+        def Matches(cached_key):
+            if cached_key[:4] != key[:4]:
+                return False
+            cached_path = cached_key[4].split('?')[0]
+            return cached_path.startswith(path) or cached_path == parent
+        self.response_cache.invalidate_prefix(Matches)
+
+    def deadline(self, seconds):
+        """Returns a raws_json.deadline.Deadline, to bound a sequence of requests.
+
+        Within a with block, every request of the current thread (and the calls
+        it submits to batch(), map() or an AsyncRawsService) must be done
+        within seconds, otherwise raws_json.deadline.DeadlineExceeded is raised.
+
+        Example:
+          with rats.deadline(120):
+              src = rats.createSrc("movie.mp4", "/tmp/movie.mp4")
+              job = rats.createJob(...)
+        """
+        return Deadline(seconds)
+
+    def span(self, name, **attributes):
+        """Returns a raws_json.tracing.Span, to nest the requests of a sequence
+        of calls under it.
+
+        Within a with block, the requests of the current thread (and the calls
+        it submits to batch(), map() or an AsyncRawsService) are recorded as
+        child spans. Without a tracer, a span which does nothing is returned.
+
+        Example:
+          with rats.span("publish", filename="movie.mp4"):
+              src = rats.createSrc("movie.mp4", "/tmp/movie.mp4")
+              job = rats.createJob(...)
+        """
+        if self.tracer is None:
+            return NULL_SPAN
+        attributes.setdefault("service.name", self.__class__.__name__)
+        return self.tracer.start_span(name, attributes)
+
+    # Bulk operations
+    def batch(self, calls, max_workers=8, ordered=True):
+        """Executes a list of calls concurrently on a bounded number of threads.
+
+        All calls share the connection pool of this service. A call which raises
+        a RequestError doesn't stop the others: the RequestError is returned in
+        place of its result. Other exceptions are raised when the result of the
+        failing call is collected.
+
+        Example:
+          results = rass.batch([(rass.deleteItem, ("a/1.mp4",)), ("getItemHeaderFromPath", ("a/2.mp4",))])
+
+        Args:
+          calls: list Each call is a callable without arguments or a tuple
+              (method, args) or (method, args, kwargs). The method is a callable
+              or the name of a method of this service.
+          max_workers: int (optional) Maximum number of calls executing at the
+              same time.
+          ordered: bool (optional) If True, return a list with the results in
+              the order of the calls. If False, return a generator which yields
+              (index, result) tuples as the calls finish.
+
+        Returns:
+          A list of results, or a generator of (index, result) tuples.
+        """
+        tasks = [self.__GetBatchTask(call) for call in calls]
+        executor = WorkerPool(max_workers)
+        futures = [executor.submit(Bind(BindSpan(_BatchCall)), fn, args, kwargs) for (fn, args, kwargs) in tasks]
+        indexes = dict((id(f), i) for (i, f) in enumerate(futures))
+        executor.shutdown(wait=False)
+        if ordered:
+            return [f.result() for f in futures]
+        return ((indexes[id(f)], f.result()) for f in as_completed(futures))
+
+    def map(self, method, args_list, max_workers=8, ordered=True):
+        """Calls method once for every item in args_list, see batch().
+
+        Example:
+          results = rass.map(rass.deleteItem, ["a/1.mp4", "a/2.mp4"])
+
+        Args:
+          method: callable or name of a method of this service.
+          args_list: list Each item is the single argument of a call, or a tuple
+              with the arguments of a call.
+          max_workers: int (optional) Maximum number of calls executing at the
+              same time.
+          ordered: bool (optional) See batch().
+        """
+        calls = []
+        for args in args_list:
+            if not isinstance(args, tuple):
+                args = (args,)
+            calls.append((method, args))
+        return self.batch(calls, max_workers=max_workers, ordered=ordered)
+
+    def __GetBatchTask(self, call):
+        if callable(call):
+            return (call, (), {})
+        fn = call[0]
+        if isinstance(fn, basestring):
+            fn = getattr(self, fn)
+        args = tuple(call[1]) if len(call) > 1 else ()
+        kwargs = call[2] if len(call) > 2 else {}
+        return (fn, args, kwargs)
+
     def get_enclosure_link(self, entry):
         url = None
         for link in entry["entry"]["link"]:
@@ -520,6 +1026,20 @@ class RawsService(raws_json.JsonService):
         return url
 
 
+def _JsonDefault(obj):
+    # Entries taken from a Feed can be posted back as they are.
+    if isinstance(obj, EntryView):
+        return obj.to_dict()
+    raise TypeError(repr(obj) + " is not JSON serializable")
+
+
+def _BatchCall(fn, args, kwargs):
+    try:
+        return fn(*args, **kwargs)
+    except RequestError, e:
+        return e
+
+
 class Query(dict):
   """Constructs a query URL to be used in GET requests
 
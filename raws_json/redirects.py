@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 rambla.eu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Remembers permanent redirects, so later requests skip the extra round trip.
+
+  RedirectCache: Maps URIs to the URIs they were permanently (301/308)
+       redirected to. Only the exact URI is remembered: a redirect of one file
+       says nothing about the other files in its directory. A 301 turns a POST
+       into a GET without data, so it only applies to GET and HEAD requests;
+       a 308 applies to every request.
+
+  KeepsCredentials: Whether the credentials of a request may be sent along
+       when it is redirected.
+"""
+import threading
+import urlparse
+from collections import OrderedDict
+
+# Responses which are followed by HttpRequest, and those which are remembered.
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+PERMANENT_REDIRECT_STATUSES = (301, 308)
+
+# Methods which a 301 redirect is remembered (and applied) for.
+SAFE_METHODS = ('GET', 'HEAD')
+
+# Headers which are not sent to another host than the one they were meant for.
+CREDENTIAL_HEADERS = ('authorization', 'cookie')
+
+
+class RedirectCache(object):
+  """Thread-safe map of permanently redirected URIs."""
+
+  def __init__(self, max_entries=256):
+    self.max_entries = max_entries
+    self._moved = OrderedDict()
+    self._lock = threading.Lock()
+
+  def add(self, source, target, status=301):
+    """Records that the absolute URI source was permanently moved to target,
+    by a redirect with the given status (301 or 308)."""
+    source = NormalizeUri(source)
+    target = NormalizeUri(target)
+    self._lock.acquire()
+    try:
+      # Forget a redirect which would now send target elsewhere (e.g. back to
+      # where it came from).
+      self._moved.pop(target, None)
+      self._moved.pop(source, None)
+      self._moved[source] = (target, status)
+      while len(self._moved) > self.max_entries:
+        self._moved.popitem(last=False)
+    finally:
+      self._lock.release()
+
+  def resolve(self, uri, operation='GET'):
+    """Returns the URI which a request for the absolute URI uri, with the HTTP
+    method operation, is to be sent to instead, or None."""
+    uri = NormalizeUri(uri)
+    self._lock.acquire()
+    try:
+      (target, status) = self._moved.get(uri, (None, None))
+    finally:
+      self._lock.release()
+    if status == 301 and operation not in SAFE_METHODS:
+      return None
+    return target
+
+  def clear(self):
+    self._lock.acquire()
+    try:
+      self._moved.clear()
+    finally:
+      self._lock.release()
+
+
+def NormalizeUri(uri):
+  """Returns the absolute uri with an explicit port and path."""
+  parts = urlparse.urlsplit(uri)
+  port = parts.port
+  if port is None:
+    port = parts.scheme == 'https' and 443 or 80
+  uri = '%s://%s:%d%s' % (parts.scheme, parts.hostname, port, parts.path or '/')
+  if parts.query:
+    uri += '?' + parts.query
+  return uri
+
+
+def KeepsCredentials(source, target):
+  """Returns whether a request for the absolute URI source, which was
+  redirected to target, may send its credentials (CREDENTIAL_HEADERS) to
+  target: only when it stays on the same host, and doesn't go from https to
+  plain http."""
+  source_parts = urlparse.urlsplit(source)
+  target_parts = urlparse.urlsplit(target)
+  if source_parts.hostname != target_parts.hostname:
+    return False
+  return not (source_parts.scheme == 'https' and target_parts.scheme != 'https')
@@ -0,0 +1,227 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 rambla.eu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Hooks which are called at each phase of the requests of a service.
+
+  RequestHooks: The hooks of a service, per phase. HttpRequest creates a
+       RequestEvent for every attempt of a request and passes it to the hooks
+       of each phase it goes through:
+
+         REQUEST_START       the request is about to be sent, hooks may still
+                             change event.headers
+         DNS                 the host name of a new connection is resolved
+         CONNECT             the TCP connection is established
+         TLS                 the TLS handshake is done (HTTPS only)
+         REQUEST_SENT        the headers and the body have been sent
+         FIRST_BYTE          the status line and headers have been received
+         TRANSFER_COMPLETE   the body has been read (or the response closed)
+         REQUEST_ERROR       the request failed, or reading the body failed
+
+       DNS, CONNECT and TLS only occur when a new connection is opened. Every
+       event ends with either TRANSFER_COMPLETE or REQUEST_ERROR.
+
+  RequestEvent: The request, and the timeit.default_timer() timestamps of the
+       phases it went through.
+
+  UriTemplate: The default URI template, which keeps the endpoint of a path
+       ('/item/{path}').
+"""
+import sys
+import timeit
+import urlparse
+
+REQUEST_START = 'request_start'
+DNS = 'dns'
+CONNECT = 'connect'
+TLS = 'tls'
+REQUEST_SENT = 'request_sent'
+FIRST_BYTE = 'first_byte'
+TRANSFER_COMPLETE = 'transfer_complete'
+REQUEST_ERROR = 'request_error'
+
+PHASES = (REQUEST_START, DNS, CONNECT, TLS, REQUEST_SENT, FIRST_BYTE,
+          TRANSFER_COMPLETE, REQUEST_ERROR)
+
+
+class RequestEvent(object):
+  """One attempt of a request, as passed to the hooks.
+
+  service: The service which sends the request.
+  operation: str The HTTP method.
+  uri: str The absolute URI of the request.
+  uri_template: str The URI without its variable parts, for grouping.
+  headers: dict The extra headers of the request (in addition to the
+      additional_headers of the service).
+  attempt: int 0 for the first attempt, 1 for the first retry, ...
+  reused: bool Whether the request was sent over a pooled connection.
+  timings: dict The timestamp of each phase the request went through.
+  bytes_sent: int Number of bytes of the request body sent.
+  bytes_received: int Number of bytes of the response body received (as sent
+      by the server, so before it is decompressed).
+  status: int The status of the response, None until FIRST_BYTE.
+  complete: bool Whether the whole body was read, set at TRANSFER_COMPLETE.
+  error: The exception, set at REQUEST_ERROR.
+  """
+
+  def __init__(self, hooks, service, operation, uri, uri_template, headers,
+               attempt=0):
+    self.hooks = hooks
+    self.service = service
+    self.operation = operation
+    self.uri = uri
+    self.uri_template = uri_template
+    self.headers = headers
+    self.attempt = attempt
+    self.reused = False
+    self.timings = {}
+    self.bytes_sent = 0
+    self.bytes_received = 0
+    self.status = None
+    self.complete = None
+    self.error = None
+
+  def fire(self, phase):
+    """Records the time of phase and calls the hooks of phase."""
+    self.timings[phase] = timeit.default_timer()
+    self.hooks.fire(phase, self)
+
+  def elapsed(self, phase, since=REQUEST_START):
+    """Returns the number of seconds between the phases since and phase, or
+    None if the request didn't go through both of them."""
+    if phase not in self.timings or since not in self.timings:
+      return None
+    return self.timings[phase] - self.timings[since]
+
+  def __repr__(self):
+    return '<RequestEvent %s %s attempt=%s status=%s>' % (self.operation,
+        self.uri_template, self.attempt, self.status)
+
+
+class RequestHooks(object):
+  """The hooks of one or more services, per phase.
+
+  A hook is called as hook(event) with a RequestEvent. Exceptions raised by a
+  hook are not caught, so they abort the request.
+
+  Example:
+    def Ttfb(event):
+      histogram.observe(event.elapsed(FIRST_BYTE, REQUEST_SENT))
+    meta.request_hooks.add(FIRST_BYTE, Ttfb)
+  """
+
+  def __init__(self, uri_template=None):
+    """Creates a new RequestHooks.
+
+    Args:
+      uri_template: func (optional) Called as uri_template(uri) to get the
+          template of the absolute uri of a request, defaults to UriTemplate.
+    """
+    self.uri_template = uri_template or UriTemplate
+    self._hooks = {}
+
+  def add(self, phase, hook):
+    """Adds a hook for phase, one of PHASES."""
+    if phase not in PHASES:
+      raise ValueError('Unknown request phase %r' % (phase,))
+    # The lists are replaced rather than changed, so adding or removing a hook
+    # doesn't disturb the requests which are calling the hooks.
+    self._hooks[phase] = self._hooks.get(phase, []) + [hook]
+
+  def remove(self, phase, hook):
+    hooks = list(self._hooks.get(phase, []))
+    hooks.remove(hook)
+    self._hooks[phase] = hooks
+
+  def fire(self, phase, event):
+    for hook in self._hooks.get(phase, ()):
+      hook(event)
+
+  def start(self, service, operation, uri, headers, attempt=0):
+    """Returns the RequestEvent for an attempt of a request, after calling
+    the REQUEST_START hooks."""
+    event = RequestEvent(self, service, operation, uri, self.uri_template(uri),
+                         headers, attempt)
+    event.fire(REQUEST_START)
+    return event
+
+  def __nonzero__(self):
+    for hooks in self._hooks.values():
+      if hooks:
+        return True
+    return False
+
+
+class TimedResponse(object):
+  """Wraps an httplib.HTTPResponse, counts the bytes of its body and fires
+  TRANSFER_COMPLETE once it has been read or closed."""
+
+  def __init__(self, response, event):
+    self._response = response
+    self._event = event
+    self._done = False
+    if response.length == 0 and not response.chunked:
+      # Nothing to read (e.g. HEAD, 204, 304).
+      self._Done(True)
+
+  def __getattr__(self, name):
+    return getattr(self._response, name)
+
+  def read(self, amt=None):
+    try:
+      if amt is None:
+        data = self._response.read()
+      else:
+        data = self._response.read(amt)
+    except:
+      if not self._done:
+        self._done = True
+        self._event.error = sys.exc_info()[1]
+        self._event.fire(REQUEST_ERROR)
+      raise
+    self._event.bytes_received += len(data)
+    if self._response.isclosed():
+      self._Done(True)
+    return data
+
+  def close(self):
+    fully_read = self._response.isclosed()
+    self._response.close()
+    self._Done(fully_read)
+
+  def _Done(self, complete):
+    if self._done:
+      return
+    self._done = True
+    self._event.complete = complete
+    self._event.fire(TRANSFER_COMPLETE)
+
+  def __del__(self):
+    if '_response' not in self.__dict__:
+      return
+    try:
+      self.close()
+    except Exception:
+      pass
+
+
+def UriTemplate(uri):
+  """Returns the path of uri, with everything after its first segment
+  replaced by '{path}', e.g. '/item/{path}' for '/item/user/movie.mp4'."""
+  path = urlparse.urlsplit(uri).path
+  parts = path.lstrip('/').split('/', 1)
+  if len(parts) == 1 or not parts[1]:
+    return path
+  return '/%s/{path}' % parts[0]
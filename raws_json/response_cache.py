@@ -0,0 +1,199 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 rambla.eu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Client-side cache for GET responses, revalidated with conditional requests.
+
+  ResponseCache: Keeps response bodies together with their ETag and
+       Last-Modified validators and their freshness lifetime (Cache-Control
+       max-age or Expires). Fresh responses are served without a request,
+       stale ones are revalidated with If-None-Match / If-Modified-Since.
+       Entries are evicted least-recently-used first, within a maximum number
+       of entries and a byte budget.
+"""
+import calendar
+import email.utils
+import re
+import threading
+import time
+from collections import OrderedDict
+
+_MAX_AGE = re.compile(r'max-age\s*=\s*"?(\d+)"?')
+
+
+class CachedResponse(object):
+  """A cached response body with its validators."""
+
+  __slots__ = ('body', 'etag', 'last_modified', 'expires')
+
+  def __init__(self, body, etag=None, last_modified=None, expires=0):
+    self.body = body
+    self.etag = etag
+    self.last_modified = last_modified
+    self.expires = expires
+
+  def is_fresh(self):
+    """Returns True if the response may be used without revalidation."""
+    return time.time() < self.expires
+
+  def validators(self):
+    """Returns the headers for a conditional request."""
+    headers = {}
+    if self.etag:
+      headers['If-None-Match'] = self.etag
+    if self.last_modified:
+      headers['If-Modified-Since'] = self.last_modified
+    return headers
+
+
+class ResponseCache(object):
+  """Thread-safe LRU cache of GET responses.
+
+  Example:
+    cache = ResponseCache(max_bytes=16 * 1024 * 1024)
+    meta = MetaService(USER, PWD)
+    meta.response_cache = cache
+  """
+
+  def __init__(self, max_entries=1000, max_bytes=32 * 1024 * 1024):
+    """Creates a new ResponseCache.
+
+    Args:
+      max_entries: int (optional) Maximum number of cached responses.
+      max_bytes: int (optional) Maximum total size of the cached bodies.
+    """
+    self.max_entries = max_entries
+    self.max_bytes = max_bytes
+    self.size = 0
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+
+  def lookup(self, key):
+    """Returns the CachedResponse for key (fresh or not), or None."""
+    self._lock.acquire()
+    try:
+      cached = self._entries.pop(key, None)
+      if cached is not None:
+        # Mark as most recently used.
+        self._entries[key] = cached
+      return cached
+    finally:
+      self._lock.release()
+
+  def store(self, key, response, body):
+    """Stores the body of a 200 response, if its headers allow it.
+
+    Responses which say no-store, or which can neither be revalidated nor are
+    fresh for some time, are not stored.
+
+    Returns:
+      The CachedResponse, or None if the response was not stored.
+    """
+    cache_control = (response.getheader('Cache-Control') or '').lower()
+    if 'no-store' in cache_control or len(body) > self.max_bytes:
+      self.invalidate(key)
+      return None
+    cached = CachedResponse(body, response.getheader('ETag'),
+        response.getheader('Last-Modified'))
+    cached.expires = _Expires(response, cache_control)
+    if not (cached.etag or cached.last_modified or cached.is_fresh()):
+      self.invalidate(key)
+      return None
+    self._lock.acquire()
+    try:
+      old = self._entries.pop(key, None)
+      if old is not None:
+        self.size -= len(old.body)
+      self._entries[key] = cached
+      self.size += len(body)
+      self._Evict()
+    finally:
+      self._lock.release()
+    return cached
+
+  def refresh(self, key, response):
+    """Updates the freshness of a cached response after a 304 (Not Modified).
+
+    Returns:
+      The CachedResponse, or None if it is no longer cached.
+    """
+    self._lock.acquire()
+    try:
+      cached = self._entries.get(key)
+      if cached is None:
+        return None
+      cache_control = (response.getheader('Cache-Control') or '').lower()
+      cached.expires = _Expires(response, cache_control)
+      cached.etag = response.getheader('ETag') or cached.etag
+      cached.last_modified = (response.getheader('Last-Modified') or
+          cached.last_modified)
+      return cached
+    finally:
+      self._lock.release()
+
+  def invalidate(self, key):
+    """Removes key from the cache."""
+    self._lock.acquire()
+    try:
+      cached = self._entries.pop(key, None)
+      if cached is not None:
+        self.size -= len(cached.body)
+    finally:
+      self._lock.release()
+
+  def invalidate_prefix(self, prefix):
+    """Removes every key for which prefix(key) is True.
+
+    Args:
+      prefix: func Called with each cached key.
+    """
+    self._lock.acquire()
+    try:
+      for key in [k for k in self._entries if prefix(k)]:
+        self.size -= len(self._entries.pop(key).body)
+    finally:
+      self._lock.release()
+
+  def clear(self):
+    self._lock.acquire()
+    try:
+      self._entries.clear()
+      self.size = 0
+    finally:
+      self._lock.release()
+
+  def __len__(self):
+    return len(self._entries)
+
+  def _Evict(self):
+    while self._entries and (len(self._entries) > self.max_entries or
+                             self.size > self.max_bytes):
+      (key, cached) = self._entries.popitem(last=False)
+      self.size -= len(cached.body)
+
+
+def _Expires(response, cache_control):
+  """Returns the time until which the response is fresh."""
+  if 'no-cache' in cache_control:
+    return 0
+  m = _MAX_AGE.search(cache_control)
+  if m:
+    return time.time() + int(m.group(1))
+  expires = response.getheader('Expires')
+  if expires:
+    parsed = email.utils.parsedate(expires)
+    if parsed:
+      return calendar.timegm(parsed)
+  return 0
@@ -0,0 +1,146 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 rambla.eu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Decides when and after how long HttpRequest sends a failed request again.
+
+  RetryPolicy: Retries requests which failed with a connection error or a
+       transient status (502, 503, ...), if their method is idempotent or the
+       request was marked as such. The delay between attempts grows
+       exponentially with "decorrelated jitter", unless the server asks for a
+       specific delay with a Retry-After header.
+"""
+import calendar
+import email.utils
+import random
+import threading
+import time
+
+# Methods which may be sent again without changing the outcome.
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+# Statuses which indicate a transient problem of the server (or a proxy).
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+class RetryPolicy(object):
+  """Configures the retries of the requests of a service.
+
+  The number of retries is counted in the retries member (for all requests),
+  and in the retries attribute of each returned response.
+
+  Example:
+    rass = RassService(USER, PWD, RASS_SERVER)
+    rass.retry_policy = RetryPolicy(max_retries=5)
+  """
+
+  def __init__(self, max_retries=3, base_delay=0.5, max_delay=30,
+               statuses=RETRY_STATUSES, methods=IDEMPOTENT_METHODS,
+               max_retry_after=120, on_retry=None):
+    """Creates a new RetryPolicy.
+
+    Args:
+      max_retries: int (optional) Maximum number of times a request is sent
+          again.
+      base_delay: float (optional) Minimum delay in seconds before a retry.
+      max_delay: float (optional) Maximum delay in seconds before a retry.
+      statuses: tuple (optional) HTTP statuses which are retried.
+      methods: tuple (optional) HTTP methods which are retried. Requests with
+          another method (POST) are only retried if they are marked as
+          idempotent.
+      max_retry_after: float (optional) If the server asks to wait longer
+          than this (with a Retry-After header), its response is returned
+          instead.
+      on_retry: func (optional) Called as on_retry(operation, uri, attempt,
+          delay, reason) before sleeping, reason is the HTTP status or the
+          exception.
+    """
+    self.max_retries = max_retries
+    self.base_delay = base_delay
+    self.max_delay = max_delay
+    self.statuses = statuses
+    self.methods = methods
+    self.max_retry_after = max_retry_after
+    self.on_retry = on_retry
+    self.retries = 0
+    self._lock = threading.Lock()
+
+  def allows(self, operation, idempotent=None):
+    """Returns True if a request with this method may be retried.
+
+    Args:
+      operation: str The HTTP method.
+      idempotent: bool (optional) True or False to override the default for
+          the method.
+    """
+    if idempotent is None:
+      return operation in self.methods
+    return idempotent
+
+  def backoff(self, previous_delay=None):
+    """Returns the delay before the next attempt (decorrelated jitter).
+
+    Args:
+      previous_delay: float (optional) The delay before the previous attempt,
+          None for the first retry.
+    """
+    if previous_delay is None:
+      previous_delay = self.base_delay
+    delay = random.uniform(self.base_delay, previous_delay * 3)
+    return min(self.max_delay, delay)
+
+  def delay(self, attempt, previous_delay=None, response=None):
+    """Returns the number of seconds to wait before retrying, or None if the
+    request should not be retried (anymore).
+
+    Args:
+      attempt: int Number of retries so far.
+      previous_delay: float (optional) The delay before the previous retry.
+      response: The response (if any) with a status from statuses.
+    """
+    if attempt >= self.max_retries:
+      return None
+    delay = self.backoff(previous_delay)
+    if response is not None:
+      retry_after = ParseRetryAfter(response.getheader('Retry-After'))
+      if retry_after is not None:
+        if retry_after > self.max_retry_after:
+          return None
+        delay = max(delay, retry_after)
+    return delay
+
+  def record(self, operation, uri, attempt, delay, reason):
+    """Counts a retry and calls on_retry."""
+    self._lock.acquire()
+    try:
+      self.retries += 1
+    finally:
+      self._lock.release()
+    if self.on_retry:
+      self.on_retry(operation, uri, attempt, delay, reason)
+
+
+def ParseRetryAfter(value):
+  """Returns the number of seconds in a Retry-After header (delta-seconds or
+  HTTP date), or None."""
+  if not value:
+    return None
+  value = value.strip()
+  if value.isdigit():
+    return int(value)
+  parsed = email.utils.parsedate(value)
+  if parsed is None:
+    return None
+  return max(calendar.timegm(parsed) - time.time(), 0)
@@ -0,0 +1,75 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 rambla.eu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""SSL contexts shared by the HTTPS connections of the services.
+
+  Without a context, httplib creates a new default context for every HTTPS
+  connection, which loads and parses the CA certificates again each time.
+  A shared context does that once.
+
+  CreateContext: Creates a configured ssl.SSLContext.
+
+  GetDefaultContext: Returns the context shared by all services which don't
+       have their own.
+"""
+import ssl
+import threading
+
+_default_context = None
+_default_lock = threading.Lock()
+
+
+def CreateContext(cafile=None, capath=None, verify=True, certfile=None,
+                  keyfile=None, ciphers=None):
+  """Creates an SSLContext for HTTPS connections.
+
+  Args:
+    cafile: str (optional) File with the trusted CA certificates, the system
+        certificates are used by default.
+    capath: str (optional) Directory with the trusted CA certificates.
+    verify: bool (optional) If False, the certificate of the server is not
+        verified.
+    certfile: str (optional) Client certificate.
+    keyfile: str (optional) Private key of the client certificate.
+    ciphers: str (optional) OpenSSL cipher list.
+
+  Returns:
+    An ssl.SSLContext, or None if this Python version doesn't support them
+    (before 2.7.9); httplib's defaults are used then.
+  """
+  if not hasattr(ssl, 'create_default_context'):
+    return None
+  context = ssl.create_default_context(cafile=cafile, capath=capath)
+  if not verify:
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+  if certfile:
+    context.load_cert_chain(certfile, keyfile)
+  if ciphers:
+    context.set_ciphers(ciphers)
+  return context
+
+
+def GetDefaultContext():
+  """Returns the SSLContext shared by all services (created on first use)."""
+  global _default_context
+  _default_lock.acquire()
+  try:
+    if _default_context is None:
+      _default_context = CreateContext()
+    return _default_context
+  finally:
+    _default_lock.release()
@@ -0,0 +1,305 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 rambla.eu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tracing of the requests of the services, with W3C trace context headers.
+
+  Tracer: Creates spans and hands the finished ones to an exporter. A service
+       with a tracer creates a span for every request (Get, Post, Put, Delete,
+       Head), and sends its id to the server in a traceparent header.
+
+  Span: A timed operation within a trace. Used as a context manager, a span
+       becomes the parent of the spans (and requests) started by the current
+       thread within the with block, so the requests of a high-level call
+       (e.g. RatsService.encodeFile) are nested under it.
+
+  JsonLinesExporter: Appends finished spans to a file, one JSON object per
+       line, for offline analysis.
+
+  MemoryExporter: Keeps finished spans in a list.
+
+  Bind: Makes a function run under the current span of the calling thread,
+       when it is executed on another (worker) thread.
+"""
+import binascii
+import json
+import os
+import threading
+import time
+import timeit
+
+_local = threading.local()
+
+
+class Span(object):
+  """A timed operation within a trace.
+
+  trace_id: str 32 hex digits, shared by all spans of a trace.
+  span_id: str 16 hex digits.
+  parent_id: str The span_id of the parent span, None for the root span.
+  name: str e.g. 'GET /item/{path}'.
+  attributes: dict Details of the operation (service.name, http.status_code,
+      ...).
+  start_time: float The time.time() at which the span started.
+  duration: float Number of seconds the span took, set when it ends.
+  error: str The exception which ended the span, if any.
+  """
+
+  def __init__(self, tracer, name, trace_id, parent_id=None, attributes=None):
+    self.tracer = tracer
+    self.name = name
+    self.trace_id = trace_id
+    self.span_id = _NewId(8)
+    self.parent_id = parent_id
+    self.attributes = dict(attributes or {})
+    self.start_time = time.time()
+    self.duration = None
+    self.error = None
+    self._start = timeit.default_timer()
+    self._outer = []
+
+  def set_attribute(self, key, value):
+    self.attributes[key] = value
+
+  def traceparent(self):
+    """Returns the value of the traceparent header for requests made within
+    this span."""
+    return '00-%s-%s-01' % (self.trace_id, self.span_id)
+
+  def end(self, error=None):
+    """Ends the span and exports it; later calls are ignored."""
+    if self.duration is not None:
+      return
+    self.duration = timeit.default_timer() - self._start
+    if error is not None:
+      self.error = '%s: %s' % (error.__class__.__name__, error)
+    self.tracer.export(self)
+
+  def to_dict(self):
+    return {'trace_id': self.trace_id, 'span_id': self.span_id,
+            'parent_id': self.parent_id, 'name': self.name,
+            'start_time': self.start_time, 'duration': self.duration,
+            'attributes': self.attributes, 'error': self.error}
+
+  def __enter__(self):
+    self._outer.append(Current())
+    _local.span = self
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    _local.span = self._outer.pop()
+    self.end(exc_value)
+    return False
+
+  def __repr__(self):
+    return '<Span %s %s/%s>' % (self.name, self.trace_id, self.span_id)
+
+
+class _NullSpan(object):
+  """Stands in for a Span when there is no tracer."""
+
+  def set_attribute(self, key, value):
+    pass
+
+  def end(self, error=None):
+    pass
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Tracer(object):
+  """Creates spans and exports them when they end.
+
+  Example:
+    tracer = Tracer(JsonLinesExporter('/var/log/raws-spans.jsonl'))
+    rats = RatsService(USER, PWD, tracer=tracer)
+    with tracer.start_span('publish', {'filename': 'movie.mp4'}):
+      rats.encodeFile('movie.mp4', '/tmp/movie.mp4', wait=True)
+  """
+
+  def __init__(self, exporter=None):
+    """Creates a new Tracer.
+
+    Args:
+      exporter: (optional) Object whose export(span) method is called with
+          every span that ends, e.g. a JsonLinesExporter. Defaults to a
+          MemoryExporter.
+    """
+    if exporter is None:
+      exporter = MemoryExporter()
+    self.exporter = exporter
+
+  def start_span(self, name, attributes=None, parent=None):
+    """Starts a span.
+
+    Args:
+      name: str The name of the span.
+      attributes: dict (optional) Attributes of the span.
+      parent: Span or str (optional) The parent span, or the value of a
+          traceparent header received from another process. Defaults to the
+          current span of the thread; without one, a new trace is started.
+
+    Returns:
+      The Span. Use it as a context manager, or call its end() method.
+    """
+    if parent is None:
+      parent = Current()
+    if isinstance(parent, basestring):
+      parent = ParseTraceparent(parent)
+      if parent is not None:
+        return Span(self, name, parent[0], parent[1], attributes)
+    elif parent is not None:
+      return Span(self, name, parent.trace_id, parent.span_id, attributes)
+    return Span(self, name, _NewId(16), None, attributes)
+
+  def export(self, span):
+    self.exporter.export(span)
+
+
+class MemoryExporter(object):
+  """Keeps the finished spans in its spans list."""
+
+  def __init__(self):
+    self.spans = []
+
+  def export(self, span):
+    self.spans.append(span)
+
+  def clear(self):
+    del self.spans[:]
+
+
+class JsonLinesExporter(object):
+  """Appends finished spans to a file, one JSON object (see Span.to_dict)
+  per line."""
+
+  def __init__(self, path):
+    """Creates a new JsonLinesExporter.
+
+    Args:
+      path: str The file the spans are appended to, or a file-like object.
+    """
+    if isinstance(path, basestring):
+      self.file = open(path, 'a')
+    else:
+      self.file = path
+    self._lock = threading.Lock()
+
+  def export(self, span):
+    line = json.dumps(span.to_dict(), sort_keys=True) + '\n'
+    self._lock.acquire()
+    try:
+      self.file.write(line)
+      self.file.flush()
+    finally:
+      self._lock.release()
+
+  def close(self):
+    self.file.close()
+
+
+class TracedResponse(object):
+  """Wraps the response of a traced request, and ends its span once the body
+  has been read or the response is closed."""
+
+  def __init__(self, response, span):
+    self._response = response
+    self._span = span
+    self._received = 0
+    if response.isclosed() or (response.length == 0 and not response.chunked):
+      # Nothing to read (e.g. HEAD, 204, 304).
+      self._End()
+
+  def __getattr__(self, name):
+    return getattr(self._response, name)
+
+  def read(self, amt=None):
+    try:
+      if amt is None:
+        data = self._response.read()
+      else:
+        data = self._response.read(amt)
+    except Exception, e:
+      self._span.end(e)
+      raise
+    self._received += len(data)
+    if self._response.isclosed():
+      self._End()
+    return data
+
+  def close(self):
+    self._response.close()
+    self._End()
+
+  def _End(self):
+    self._span.set_attribute('http.response_content_length', self._received)
+    self._span.end()
+
+  def __del__(self):
+    if '_response' not in self.__dict__:
+      return
+    try:
+      self.close()
+    except Exception:
+      pass
+
+
+def Current():
+  """Returns the current Span of the thread, or None."""
+  return getattr(_local, 'span', None)
+
+
+def Bind(fn):
+  """Returns a function which calls fn with the current Span of the calling
+  thread (if any) as its current span, wherever it is executed."""
+  span = Current()
+  if span is None:
+    return fn
+  def Bound(*args, **kwargs):
+    outer = Current()
+    _local.span = span
+    try:
+      return fn(*args, **kwargs)
+    finally:
+      _local.span = outer
+  return Bound
+
+
+def ParseTraceparent(header):
+  """Returns the (trace_id, span_id) of a traceparent header, or None if it
+  is not valid."""
+  parts = header.strip().lower().split('-')
+  if (len(parts) < 4 or len(parts[0]) != 2 or len(parts[1]) != 32 or
+      len(parts[2]) != 16 or parts[0] == 'ff'):
+    return None
+  try:
+    int(parts[1], 16)
+    int(parts[2], 16)
+  except ValueError:
+    return None
+  if parts[1] == '0' * 32 or parts[2] == '0' * 16:
+    return None
+  return (parts[1], parts[2])
+
+
+def _NewId(size):
+  return binascii.hexlify(os.urandom(size))
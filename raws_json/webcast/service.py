@@ -47,6 +47,15 @@ class WebcastService(RawsService):
             uri = query.ToUri()
         return self.Get(uri = uri)
 
+    def iter_webcast_list(self, query = None, prefetch = 0):
+        """ Iterates over the webcast list, across all pages of the feed.
+
+            @param query raws_json.Query object that contains queryset args.
+            @param int prefetch : optional, number of pages fetched ahead in the background while the current page is processed.
+            @return generator yielding webcast entries (= {"entry": ...} dicts)
+        """
+        return self.iter_feed("/webcast/" + self.username + "/", query, prefetch = prefetch)
+
     def deleteWebcast(self, entry):
         """ Deletes the webcast instance that was passed as argument.
 